@@ -0,0 +1,261 @@
+"""
+Elasticsearch stand-in for the benchmarks.
+
+Replays the recorded responses in fixtures/es/ with a configurable delay and
+payload size, for the endpoints search.py calls: _search (hits or
+aggregations), _msearch, _pit and DELETE _pit. Paging works: hits carry
+synthetic sort values, and search_after continues from them until
+--total-hits have been returned.
+
+Standalone, for pointing a running search.py at it (ES_HOST=http://127.0.0.1:9201/):
+
+    python -m bench.fake_es --port 9201 --latency-ms 15 --hits 50
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, Tuple
+
+
+RESPONSES_DIR = Path(__file__).resolve().parent / "fixtures" / "es"
+SORT_KEY_RE = re.compile(r"bench-(\d+)")
+BASE_DOCUMENT_DATE = 1751615191
+
+
+@dataclass
+class FakeESConfig:
+    latency_ms: float = 10.0  # added to every request
+    jitter_ms: float = 5.0  # +/- uniform
+    hits: int = 50  # max hits per response, except point-in-time exports (the request's size caps it further)
+    total_hits: int = 2000  # documents "in the index"; paging/export stops there
+    text_bytes: int = 20000  # size of Text in _source when the request does not exclude it
+    fragment_bytes: int = 500  # size of each highlight fragment
+    fragments: int = 3  # highlight fragments per hit (fewer if the request's number_of_fragments says so)
+
+
+def _load(name: str) -> dict:
+    with open(RESPONSES_DIR / name, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _filler(size: int) -> str:
+    sentence = "People in the society need many goods and services in their everyday life. "
+    return (sentence * (size // len(sentence) + 1))[:size]
+
+
+def _excludes_text(body: dict) -> bool:
+    source = body.get("_source", True)
+    if source is False:
+        return True
+    if isinstance(source, dict):
+        return "Text" in source.get("excludes", []) or (
+            "includes" in source and "Text" not in source["includes"]
+        )
+    if isinstance(source, list):
+        return "Text" not in source
+    return False
+
+
+class ResponseFactory:
+    def __init__(self, config: FakeESConfig):
+        self.config = config
+        self.search_template = _load("search_response.json")
+        self.facets_template = _load("facets_response.json")
+        self.sources = [hit["_source"] for hit in self.search_template["hits"]["hits"]]
+        self.text = _filler(config.text_bytes)
+        self.fragment = _filler(config.fragment_bytes).replace("society", "<mark>society</mark>", 1)
+
+    def search(self, body: dict) -> dict:
+        if "aggs" in body or "aggregations" in body:
+            response = copy.deepcopy(self.facets_template)
+            response["hits"]["total"]["value"] = self.config.total_hits
+            return response
+
+        offset = 0
+        if body.get("search_after"):
+            match = SORT_KEY_RE.fullmatch(str(body["search_after"][-1]))
+            offset = int(match.group(1)) + 1 if match else 0
+        size = body.get("size", 10)
+        if "pit" not in body:
+            size = min(size, self.config.hits)
+        count = max(0, min(size, self.config.total_hits - offset))
+
+        with_text = not _excludes_text(body)
+        highlight = self._highlight_fragments(body)
+        hits = []
+        for n in range(offset, offset + count):
+            source = dict(self.sources[n % len(self.sources)])
+            source["PropId"] = f"bench-{n:09d}"
+            if with_text:
+                source["Text"] = self.text
+            hit = {
+                "_index": "document_index", "_id": source["PropId"], "_score": None, "_source": source,
+                "sort": [BASE_DOCUMENT_DATE - n, source["PropId"]],
+            }
+            if highlight is not None:
+                hit["highlight"] = {"Text": highlight}
+            hits.append(hit)
+
+        response = copy.deepcopy(self.search_template)
+        response["hits"]["hits"] = hits
+        response["hits"]["total"] = {"value": self.config.total_hits, "relation": "eq"}
+        if "pit" in body:
+            response["pit_id"] = body["pit"].get("id")
+        return response
+
+
+    def _highlight_fragments(self, body: dict) -> Optional[list]:
+        if "highlight" not in body:
+            return None
+        field = body["highlight"].get("fields", {}).get("Text", {})
+        requested = field.get("number_of_fragments", 5)
+        if requested == 0:  # whole field as one fragment
+            return [self.text.replace("society", "<mark>society</mark>")]
+        return [self.fragment] * min(requested, self.config.fragments)
+
+
+class FakeESHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like ES
+    server: "FakeESServer"
+
+    def log_message(self, format, *args):  # one line per request would dominate the run
+        pass
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, payload: dict, status: int = 200) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _delay(self) -> None:
+        config = self.server.config
+        delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def do_GET(self):
+        self._read_body()
+        if self.path.startswith("/_bench/stats"):
+            self._send(self.server.snapshot_counts())
+        else:
+            self._send({"name": "fake-es", "version": {"number": "8.0.0-bench"}})
+
+    def do_DELETE(self):
+        self._read_body()
+        self.server.count("DELETE _pit")
+        self._delay()
+        self._send({"succeeded": True, "num_freed": 1})
+
+    def do_POST(self):
+        raw = self._read_body()
+        path = self.path.split("?", 1)[0]
+        factory = self.server.factory
+        if path.endswith("/_msearch"):
+            self.server.count("_msearch")
+            lines = [line for line in raw.decode("utf-8").splitlines() if line.strip()]
+            bodies = [json.loads(line) for line in lines[1::2]]
+            self._delay()
+            self._send({"took": 5, "responses": [dict(factory.search(b), status=200) for b in bodies]})
+        elif path.endswith("/_search"):
+            body = json.loads(raw) if raw else {}
+            self.server.count("_search (aggs)" if ("aggs" in body or "aggregations" in body) else "_search")
+            self._delay()
+            self._send(factory.search(body))
+        elif path.endswith("/_pit"):
+            self.server.count("_pit")
+            self._delay()
+            self._send({"id": "bench-pit"})
+        else:
+            self._send({"error": f"fake-es does not handle {path}"}, status=404)
+
+
+class FakeESServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], config: FakeESConfig):
+        super().__init__(address, FakeESHandler)
+        self.config = config
+        self.factory = ResponseFactory(config)
+        self._counts = {}
+        self._counts_lock = threading.Lock()
+
+    def count(self, route: str) -> None:
+        with self._counts_lock:
+            self._counts[route] = self._counts.get(route, 0) + 1
+
+    def snapshot_counts(self) -> dict:
+        with self._counts_lock:
+            return dict(self._counts)
+
+
+def _serve(config_dict: dict, host: str, port: int, ready) -> None:
+    server = FakeESServer((host, port), FakeESConfig(**config_dict))
+    ready.send(server.server_address[1])
+    ready.close()
+    server.serve_forever()
+
+
+def start_fake_es(config: FakeESConfig, host: str = "127.0.0.1",
+                  port: int = 0) -> Tuple[multiprocessing.Process, str]:
+    """
+    Runs the stand-in in a separate process (so serving it does not compete
+    with the app under test for the event loop or the GIL). Returns the
+    process and its base URL; terminate the process when done.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent_end, child_end = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_serve, args=(asdict(config), host, port, child_end), daemon=True)
+    process.start()
+    if not parent_end.poll(30):
+        process.terminate()
+        raise RuntimeError("fake Elasticsearch did not start")
+    bound_port = parent_end.recv()
+    return process, f"http://{host}:{bound_port}/"
+
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve replayed Elasticsearch responses.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9201)
+    add_config_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_config_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = FakeESConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms, help="delay added to every ES call")
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--hits", type=int, default=defaults.hits, help="max hits per ES response (exports page through --total-hits)")
+    parser.add_argument("--total-hits", type=int, default=defaults.total_hits)
+    parser.add_argument("--text-bytes", type=int, default=defaults.text_bytes,
+                        help="size of Text in _source when it is not excluded")
+    parser.add_argument("--fragment-bytes", type=int, default=defaults.fragment_bytes)
+    parser.add_argument("--fragments", type=int, default=defaults.fragments)
+
+
+def config_from_args(args: argparse.Namespace) -> FakeESConfig:
+    return FakeESConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, hits=args.hits, total_hits=args.total_hits,
+        text_bytes=args.text_bytes, fragment_bytes=args.fragment_bytes, fragments=args.fragments,
+    )
+
+
+if __name__ == "__main__":
+    cli_args = parse_args()
+    fake = FakeESServer((cli_args.host, cli_args.port), config_from_args(cli_args))
+    print(f"fake Elasticsearch on http://{cli_args.host}:{fake.server_address[1]}/")
+    fake.serve_forever()
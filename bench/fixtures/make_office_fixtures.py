@@ -0,0 +1,226 @@
+"""
+Writes the DOCX/PPTX fixtures used by the conversion benchmarks:
+
+    python bench/fixtures/make_office_fixtures.py
+
+sample.docx has ~40 paragraphs of text and a few embedded PNGs (exercises the
+HTML conversion and image embedding); sample.pptx has 12 text slides
+(exercises the PDF conversion). Both are built from the bare OOXML parts so
+no Office library is needed. The generated files are checked in; rerun this
+only to change them.
+"""
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+
+
+FIXTURES_DIR = Path(__file__).resolve().parent
+
+DOCX_PARAGRAPHS = 40
+DOCX_IMAGES = 3
+PPTX_SLIDES = 12
+
+LOREM = (
+    "Think of any society. People in the society need many goods and services in their everyday life "
+    "including food, clothing, shelter, transport facilities like roads and railways, postal services "
+    "and various other services like that of teachers and doctors."
+)
+
+XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+NS_R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+NS_P = "http://schemas.openxmlformats.org/presentationml/2006/main"
+NS_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+NS_WP = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+NS_PIC = "http://schemas.openxmlformats.org/drawingml/2006/picture"
+NS_PKG_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_CONTENT_TYPES = "http://schemas.openxmlformats.org/package/2006/content-types"
+REL_OFFICE_DOCUMENT = f"{NS_R}/officeDocument"
+REL_IMAGE = f"{NS_R}/image"
+REL_SLIDE = f"{NS_R}/slide"
+REL_SLIDE_LAYOUT = f"{NS_R}/slideLayout"
+REL_SLIDE_MASTER = f"{NS_R}/slideMaster"
+REL_THEME = f"{NS_R}/theme"
+
+
+def png_bytes(width: int, height: int, rgb: tuple) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    row = b"\x00" + bytes(rgb) * width
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(row * height)) + chunk(b"IEND", b""))
+
+
+def relationships(rels: list) -> str:
+    items = "".join(f'<Relationship Id="{rid}" Type="{kind}" Target="{target}"/>' for rid, kind, target in rels)
+    return f'{XML_DECL}<Relationships xmlns="{NS_PKG_RELS}">{items}</Relationships>'
+
+
+def content_types(defaults: dict, overrides: dict) -> str:
+    items = "".join(f'<Default Extension="{ext}" ContentType="{ct}"/>' for ext, ct in defaults.items())
+    items += "".join(f'<Override PartName="{part}" ContentType="{ct}"/>' for part, ct in overrides.items())
+    return f'{XML_DECL}<Types xmlns="{NS_CONTENT_TYPES}">{items}</Types>'
+
+
+# --- DOCX ------------------------------------------------------------------
+def docx_image_run(rel_id: str, index: int) -> str:
+    size = 1828800  # 2 inches in EMU
+    return (
+        f'<w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0">'
+        f'<wp:extent cx="{size}" cy="{size}"/><wp:docPr id="{index}" name="Picture {index}"/>'
+        f'<a:graphic><a:graphicData uri="{NS_PIC}"><pic:pic>'
+        f'<pic:nvPicPr><pic:cNvPr id="{index}" name="image{index}.png"/><pic:cNvPicPr/></pic:nvPicPr>'
+        f'<pic:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+        f'<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{size}" cy="{size}"/></a:xfrm>'
+        f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr>'
+        f'</pic:pic></a:graphicData></a:graphic></wp:inline></w:drawing></w:r>'
+    )
+
+
+def build_docx(path: Path) -> None:
+    body = ['<w:p><w:pPr><w:pStyle w:val="Title"/></w:pPr><w:r><w:t>Benchmark document</w:t></w:r></w:p>']
+    image_every = DOCX_PARAGRAPHS // DOCX_IMAGES
+    image_rels = []
+    for i in range(1, DOCX_PARAGRAPHS + 1):
+        body.append(f'<w:p><w:r><w:t xml:space="preserve">{i}. {LOREM} </w:t></w:r></w:p>')
+        if i % image_every == 0 and len(image_rels) < DOCX_IMAGES:
+            n = len(image_rels) + 1
+            image_rels.append((f"rId{n}", REL_IMAGE, f"media/image{n}.png"))
+            body.append(f"<w:p>{docx_image_run(f'rId{n}', n)}</w:p>")
+    document = (
+        f'{XML_DECL}<w:document xmlns:w="{NS_W}" xmlns:r="{NS_R}" xmlns:wp="{NS_WP}" '
+        f'xmlns:a="{NS_A}" xmlns:pic="{NS_PIC}"><w:body>{"".join(body)}'
+        f'<w:sectPr><w:pgSz w:w="11906" w:h="16838"/></w:sectPr></w:body></w:document>'
+    )
+    colors = [(200, 40, 40), (40, 160, 60), (40, 80, 200)]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", content_types(
+            {"rels": "application/vnd.openxmlformats-package.relationships+xml",
+             "xml": "application/xml", "png": "image/png"},
+            {"/word/document.xml":
+                "application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"},
+        ))
+        z.writestr("_rels/.rels", relationships([("rId1", REL_OFFICE_DOCUMENT, "word/document.xml")]))
+        z.writestr("word/_rels/document.xml.rels", relationships(image_rels))
+        z.writestr("word/document.xml", document)
+        for n, (_rid, _kind, target) in enumerate(image_rels):
+            z.writestr(f"word/{target}", png_bytes(256, 256, colors[n % len(colors)]))
+
+
+# --- PPTX ------------------------------------------------------------------
+THEME = (
+    f'{XML_DECL}<a:theme xmlns:a="{NS_A}" name="Bench"><a:themeElements>'
+    '<a:clrScheme name="Bench">'
+    '<a:dk1><a:srgbClr val="000000"/></a:dk1><a:lt1><a:srgbClr val="FFFFFF"/></a:lt1>'
+    '<a:dk2><a:srgbClr val="1F497D"/></a:dk2><a:lt2><a:srgbClr val="EEECE1"/></a:lt2>'
+    '<a:accent1><a:srgbClr val="4F81BD"/></a:accent1><a:accent2><a:srgbClr val="C0504D"/></a:accent2>'
+    '<a:accent3><a:srgbClr val="9BBB59"/></a:accent3><a:accent4><a:srgbClr val="8064A2"/></a:accent4>'
+    '<a:accent5><a:srgbClr val="4BACC6"/></a:accent5><a:accent6><a:srgbClr val="F79646"/></a:accent6>'
+    '<a:hlink><a:srgbClr val="0000FF"/></a:hlink><a:folHlink><a:srgbClr val="800080"/></a:folHlink>'
+    '</a:clrScheme>'
+    '<a:fontScheme name="Bench">'
+    '<a:majorFont><a:latin typeface="Liberation Sans"/><a:ea typeface=""/><a:cs typeface=""/></a:majorFont>'
+    '<a:minorFont><a:latin typeface="Liberation Sans"/><a:ea typeface=""/><a:cs typeface=""/></a:minorFont>'
+    '</a:fontScheme>'
+    '<a:fmtScheme name="Bench">'
+    '<a:fillStyleLst>' + '<a:solidFill><a:schemeClr val="phClr"/></a:solidFill>' * 3 + '</a:fillStyleLst>'
+    '<a:lnStyleLst>' + '<a:ln w="9525"><a:solidFill><a:schemeClr val="phClr"/></a:solidFill></a:ln>' * 3
+    + '</a:lnStyleLst>'
+    '<a:effectStyleLst>' + '<a:effectStyle><a:effectLst/></a:effectStyle>' * 3 + '</a:effectStyleLst>'
+    '<a:bgFillStyleLst>' + '<a:solidFill><a:schemeClr val="phClr"/></a:solidFill>' * 3 + '</a:bgFillStyleLst>'
+    '</a:fmtScheme></a:themeElements></a:theme>'
+)
+
+EMPTY_SP_TREE = (
+    '<p:spTree><p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr>'
+    '<p:grpSpPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="0" cy="0"/>'
+    '<a:chOff x="0" y="0"/><a:chExt cx="0" cy="0"/></a:xfrm></p:grpSpPr>{shapes}</p:spTree>'
+)
+
+
+def text_box(shape_id: int, name: str, y: int, height: int, size: int, text: str) -> str:
+    return (
+        f'<p:sp><p:nvSpPr><p:cNvPr id="{shape_id}" name="{name}"/><p:cNvSpPr txBox="1"/><p:nvPr/></p:nvSpPr>'
+        f'<p:spPr><a:xfrm><a:off x="457200" y="{y}"/><a:ext cx="8229600" cy="{height}"/></a:xfrm>'
+        f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></p:spPr>'
+        f'<p:txBody><a:bodyPr wrap="square"/><a:lstStyle/><a:p><a:r><a:rPr lang="en-US" sz="{size}"/>'
+        f'<a:t>{text}</a:t></a:r></a:p></p:txBody></p:sp>'
+    )
+
+
+def build_pptx(path: Path) -> None:
+    p_ns = f'xmlns:a="{NS_A}" xmlns:r="{NS_R}" xmlns:p="{NS_P}"'
+    master = (
+        f'{XML_DECL}<p:sldMaster {p_ns}><p:cSld>{EMPTY_SP_TREE.format(shapes="")}</p:cSld>'
+        '<p:clrMap bg1="lt1" tx1="dk1" bg2="lt2" tx2="dk2" accent1="accent1" accent2="accent2" '
+        'accent3="accent3" accent4="accent4" accent5="accent5" accent6="accent6" hlink="hlink" '
+        'folHlink="folHlink"/><p:sldLayoutIdLst><p:sldLayoutId id="2147483649" r:id="rId1"/>'
+        '</p:sldLayoutIdLst></p:sldMaster>'
+    )
+    layout = (
+        f'{XML_DECL}<p:sldLayout {p_ns} type="blank"><p:cSld name="Blank">'
+        f'{EMPTY_SP_TREE.format(shapes="")}</p:cSld><p:clrMapOvr><a:masterClrMapping/></p:clrMapOvr>'
+        '</p:sldLayout>'
+    )
+    slide_ids = "".join(f'<p:sldId id="{256 + n}" r:id="rId{n + 1}"/>' for n in range(1, PPTX_SLIDES + 1))
+    presentation = (
+        f'{XML_DECL}<p:presentation {p_ns}><p:sldMasterIdLst>'
+        '<p:sldMasterId id="2147483648" r:id="rId1"/></p:sldMasterIdLst>'
+        f'<p:sldIdLst>{slide_ids}</p:sldIdLst>'
+        '<p:sldSz cx="9144000" cy="6858000" type="screen4x3"/><p:notesSz cx="6858000" cy="9144000"/>'
+        '</p:presentation>'
+    )
+    overrides = {
+        "/ppt/presentation.xml":
+            "application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml",
+        "/ppt/slideMasters/slideMaster1.xml":
+            "application/vnd.openxmlformats-officedocument.presentationml.slideMaster+xml",
+        "/ppt/slideLayouts/slideLayout1.xml":
+            "application/vnd.openxmlformats-officedocument.presentationml.slideLayout+xml",
+        "/ppt/theme/theme1.xml": "application/vnd.openxmlformats-officedocument.theme+xml",
+    }
+    for n in range(1, PPTX_SLIDES + 1):
+        overrides[f"/ppt/slides/slide{n}.xml"] = \
+            "application/vnd.openxmlformats-officedocument.presentationml.slide+xml"
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", content_types(
+            {"rels": "application/vnd.openxmlformats-package.relationships+xml", "xml": "application/xml"},
+            overrides,
+        ))
+        z.writestr("_rels/.rels", relationships([("rId1", REL_OFFICE_DOCUMENT, "ppt/presentation.xml")]))
+        z.writestr("ppt/presentation.xml", presentation)
+        z.writestr("ppt/_rels/presentation.xml.rels", relationships(
+            [("rId1", REL_SLIDE_MASTER, "slideMasters/slideMaster1.xml")]
+            + [(f"rId{n + 1}", REL_SLIDE, f"slides/slide{n}.xml") for n in range(1, PPTX_SLIDES + 1)]
+            + [(f"rId{PPTX_SLIDES + 2}", REL_THEME, "theme/theme1.xml")]
+        ))
+        z.writestr("ppt/theme/theme1.xml", THEME)
+        z.writestr("ppt/slideMasters/slideMaster1.xml", master)
+        z.writestr("ppt/slideMasters/_rels/slideMaster1.xml.rels", relationships([
+            ("rId1", REL_SLIDE_LAYOUT, "../slideLayouts/slideLayout1.xml"),
+            ("rId2", REL_THEME, "../theme/theme1.xml"),
+        ]))
+        z.writestr("ppt/slideLayouts/slideLayout1.xml", layout)
+        z.writestr("ppt/slideLayouts/_rels/slideLayout1.xml.rels", relationships([
+            ("rId1", REL_SLIDE_MASTER, "../slideMasters/slideMaster1.xml"),
+        ]))
+        for n in range(1, PPTX_SLIDES + 1):
+            shapes = (text_box(2, "Title", 457200, 1143000, 3600, f"Slide {n}")
+                      + text_box(3, "Body", 1828800, 4114800, 2000, LOREM))
+            z.writestr(f"ppt/slides/slide{n}.xml", (
+                f'{XML_DECL}<p:sld {p_ns}><p:cSld>{EMPTY_SP_TREE.format(shapes=shapes)}</p:cSld>'
+                '<p:clrMapOvr><a:masterClrMapping/></p:clrMapOvr></p:sld>'
+            ))
+            z.writestr(f"ppt/slides/_rels/slide{n}.xml.rels", relationships([
+                ("rId1", REL_SLIDE_LAYOUT, "../slideLayouts/slideLayout1.xml"),
+            ]))
+
+
+if __name__ == "__main__":
+    build_docx(FIXTURES_DIR / "sample.docx")
+    build_pptx(FIXTURES_DIR / "sample.pptx")
+    print(f"Wrote {FIXTURES_DIR / 'sample.docx'} and {FIXTURES_DIR / 'sample.pptx'}")
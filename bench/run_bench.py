@@ -0,0 +1,399 @@
+"""
+Offline benchmarks for search.py and main.py.
+
+The apps run in-process (requests go through httpx's ASGI transport, no
+sockets), their Elasticsearch calls go to bench/fake_es.py in a separate
+process, and previews are converted from the fixtures in bench/fixtures/.
+Run from the repository root:
+
+    python -m bench.run_bench
+    python -m bench.run_bench --scenarios search,attachment-lean --concurrency 32 --requests 2000
+    python -m bench.run_bench --latency-ms 40 --hits 200 --json before.json
+
+Reports per scenario: throughput, p50/p95/p99/max latency, errors, ES calls
+per request and process RSS (start and peak). The search caches are off
+unless --with-cache is given, so every request reaches the fake ES.
+Scenarios that need LibreOffice are skipped when it is not installed.
+httpx's ASGI transport buffers each response, so search-export's RSS
+includes the whole exported body held by the client side.
+
+Needs the app's own dependencies (fastapi, httpx); nothing else.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+from bench.fake_es import BASE_DOCUMENT_DATE, FakeESConfig, add_config_arguments, config_from_args, start_fake_es
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+MAIN_PY = REPO_ROOT / "main.py"
+
+QUERY_TERMS = ["society", "services", "railways", "doctors", "market", "transport", "postal",
+               "analysis", "invoice", "contract", "shelter", "teachers", "clothing", "report"]
+FILTER_VALUES = {"DocType": ["analysis", "report", "email", "memo"], "Branch": ["telecom", "finance", "legal"]}
+ATTACHMENT_BATCH_SIZE = 20
+
+# (method, url, httpx request kwargs)
+BenchRequest = Tuple[str, str, dict]
+
+
+@dataclass
+class Scenario:
+    name: str
+    app: str  # "search" or "preview"
+    make_request: Callable[[int, random.Random], BenchRequest]
+    max_requests: Optional[int] = None  # cap for expensive scenarios
+    max_concurrency: Optional[int] = None
+    needs_libreoffice: bool = False
+
+
+@dataclass
+class Result:
+    scenario: str
+    requests: int
+    concurrency: int
+    errors: int
+    seconds: float
+    throughput: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    max_ms: float
+    es_calls_per_request: float
+    rss_start_mb: float
+    rss_peak_mb: float
+    statuses: Dict[str, int] = field(default_factory=dict)
+
+
+# --- Workloads -------------------------------------------------------------
+def search_payload(rng: random.Random, page_size: int) -> dict:
+    payload = {
+        "queries": rng.sample(QUERY_TERMS, rng.randint(1, 3)),
+        "search_type": rng.choice(["any", "all"]),
+        "size": page_size,
+    }
+    if rng.random() < 0.5:
+        field_name = rng.choice(list(FILTER_VALUES))
+        payload["filters"] = {field_name: [rng.choice(FILTER_VALUES[field_name])]}
+    if rng.random() < 0.3:
+        payload["date_range"] = {"from": "2024-01-01", "to": "2025-12-31"}
+    return payload
+
+
+def build_scenarios(args: argparse.Namespace, documents_dir: Path) -> Dict[str, Scenario]:
+    page_size = args.page_size
+
+    def search(i, rng):
+        return "POST", "/search", {"json": search_payload(rng, page_size)}
+
+    def search_next_page(i, rng):
+        payload = search_payload(rng, page_size)
+        offset = rng.randint(0, 50) * page_size + page_size - 1
+        payload["search_after"] = [BASE_DOCUMENT_DATE - offset, f"bench-{offset:09d}"]
+        return "POST", "/search", {"json": payload}
+
+    def search_export(i, rng):
+        return "POST", "/search", {"json": dict(search_payload(rng, page_size), stream=True)}
+
+    def attachment(i, rng):
+        return "POST", "/handle-attachment-link", {"json": {"app_id": f"bench-{i:09d}", "is_attachment": False}}
+
+    def attachment_lean(i, rng):
+        payload = {"app_id": f"bench-{i:09d}", "is_attachment": False, "lean": True}
+        return "POST", "/handle-attachment-link", {"json": payload}
+
+    def attachments_batch(i, rng):
+        items = [{"app_id": f"bench-{i * ATTACHMENT_BATCH_SIZE + k:09d}", "is_attachment": False}
+                 for k in range(ATTACHMENT_BATCH_SIZE)]
+        return "POST", "/handle-attachment-links", {"json": {"items": items, "lean": True}}
+
+    def document_detail(i, rng):
+        return "GET", f"/documents/bench-{i:09d}", {}
+
+    warm_files = [documents_dir / "sample.docx", documents_dir / "sample.pptx"]
+
+    def documents(i, rng):
+        return "GET", f"/api/documents/{quote(str(warm_files[i % 2]))}", {}
+
+    def documents_cold(i, rng):
+        # A fresh copy per request has a new cache key, so every request converts
+        source = warm_files[i % 2]
+        copy_path = documents_dir / "cold" / f"{source.stem}-{i}{source.suffix}"
+        copy_path.parent.mkdir(exist_ok=True)
+        shutil.copyfile(source, copy_path)
+        return "GET", f"/api/documents/{quote(str(copy_path))}", {}
+
+    scenarios = [
+        Scenario("search", "search", search),
+        Scenario("search-next-page", "search", search_next_page),
+        Scenario("search-export", "search", search_export, max_requests=args.export_requests),
+        Scenario("attachment", "search", attachment),
+        Scenario("attachment-lean", "search", attachment_lean),
+        Scenario("attachments-batch", "search", attachments_batch),
+        Scenario("document-detail", "search", document_detail),
+        Scenario("documents", "preview", documents, needs_libreoffice=True),
+        Scenario("documents-cold", "preview", documents_cold, max_requests=args.conversion_requests,
+                 max_concurrency=args.conversion_concurrency, needs_libreoffice=True),
+    ]
+    return {scenario.name: scenario for scenario in scenarios}
+
+
+# --- Measurement -----------------------------------------------------------
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        import resource
+        # Peak rather than current, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.start_bytes = rss_bytes()
+        self.peak_bytes = self.start_bytes
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            self.peak_bytes = max(self.peak_bytes, rss_bytes())
+            await asyncio.sleep(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._task.cancel()
+        self.peak_bytes = max(self.peak_bytes, rss_bytes())
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest rank
+    index = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+async def fake_es_calls(es_url: str) -> int:
+    import httpx
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f"{es_url}_bench/stats")
+        return sum(response.json().values())
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int, warmup: int,
+                       seed: int, es_url: str) -> Result:
+    rng = random.Random(seed)
+    for i in range(warmup):
+        method, url, kwargs = scenario.make_request(requests + i, rng)
+        await client.request(method, url, **kwargs)
+
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    counter = itertools.count()
+
+    async def worker() -> None:
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            method, url, kwargs = scenario.make_request(i, rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, url, **kwargs)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    es_calls_before = await fake_es_calls(es_url)
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        seconds = time.perf_counter() - started
+    es_calls = await fake_es_calls(es_url) - es_calls_before
+
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+    return Result(
+        scenario=scenario.name, requests=requests, concurrency=concurrency, errors=errors,
+        seconds=round(seconds, 3), throughput=round(requests / seconds, 1) if seconds else 0.0,
+        p50_ms=round(percentile(latencies, 50) * 1000, 2), p95_ms=round(percentile(latencies, 95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 99) * 1000, 2), max_ms=round(latencies[-1] * 1000, 2),
+        es_calls_per_request=round(es_calls / requests, 2),
+        rss_start_mb=round(rss.start_bytes / 2 ** 20, 1), rss_peak_mb=round(rss.peak_bytes / 2 ** 20, 1),
+        statuses=statuses,
+    )
+
+
+# --- Apps ------------------------------------------------------------------
+def find_libreoffice() -> Optional[str]:
+    return os.getenv("LIBREOFFICE_PATH") or shutil.which("soffice") or shutil.which("libreoffice")
+
+
+def load_search_app():
+    import search
+    return search.app
+
+
+def load_preview_app(documents_dir: Path):
+    """
+    main.py expects its host module to provide app, logger, LIBREOFFICE_PATH
+    and ALLOWED_DOCUMENT_ROOTS; this plays that part.
+    """
+    from fastapi import FastAPI
+    namespace = {
+        "__name__": "bench_preview_app",
+        "__file__": str(MAIN_PY),
+        "app": FastAPI(),
+        "logger": logging.getLogger("main"),
+        "LIBREOFFICE_PATH": find_libreoffice(),
+        "ALLOWED_DOCUMENT_ROOTS": [documents_dir.resolve()],
+    }
+    exec(compile(MAIN_PY.read_text(encoding="utf-8"), str(MAIN_PY), "exec"), namespace)
+    return namespace["app"]
+
+
+async def run_app_scenarios(app, scenarios: List[Scenario], args: argparse.Namespace, es_url: str) -> List[Result]:
+    import httpx
+    results = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for scenario in scenarios:
+                requests = min(args.requests, scenario.max_requests or args.requests)
+                concurrency = min(args.concurrency, scenario.max_concurrency or args.concurrency, requests)
+                print(f"running {scenario.name}: {requests} requests, concurrency {concurrency}", file=sys.stderr)
+                results.append(await run_scenario(
+                    client, scenario, requests, concurrency, args.warmup, args.seed, es_url
+                ))
+    return results
+
+
+# --- Report ----------------------------------------------------------------
+COLUMNS = [
+    ("scenario", "{:<20}"), ("requests", "{:>8}"), ("errors", "{:>6}"), ("throughput", "{:>10}"),
+    ("p50_ms", "{:>8}"), ("p95_ms", "{:>8}"), ("p99_ms", "{:>8}"), ("max_ms", "{:>8}"),
+    ("es_calls_per_request", "{:>8}"), ("rss_start_mb", "{:>9}"), ("rss_peak_mb", "{:>9}"),
+]
+HEADERS = {"throughput": "req/s", "es_calls_per_request": "es/req", "rss_start_mb": "rss MB", "rss_peak_mb": "peak MB"}
+
+
+def print_report(results: List[Result]) -> None:
+    print(" ".join(fmt.format(HEADERS.get(name, name)) for name, fmt in COLUMNS))
+    for result in results:
+        values = asdict(result)
+        print(" ".join(fmt.format(values[name]) for name, fmt in COLUMNS))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark search.py and main.py against a fake Elasticsearch.")
+    parser.add_argument("--scenarios", default="all", help="comma-separated scenario names, or 'all'")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight")
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests before each scenario")
+    parser.add_argument("--page-size", type=int, default=20, help="'size' sent to /search")
+    parser.add_argument("--export-requests", type=int, default=5, help="cap for search-export")
+    parser.add_argument("--conversion-requests", type=int, default=10, help="cap for documents-cold")
+    parser.add_argument("--conversion-concurrency", type=int, default=2)
+    parser.add_argument("--with-cache", action="store_true", help="keep the search/facet result caches on")
+    parser.add_argument("--app-logs", action="store_true", help="leave the apps' logging on (off by default)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="also write the results (and settings) to this file")
+    parser.add_argument("--list", action="store_true", help="list the scenarios and exit")
+    add_config_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    workdir = Path(tempfile.mkdtemp(prefix="bench_"))
+    documents_dir = workdir / "documents"
+    documents_dir.mkdir()
+    for fixture in ("sample.docx", "sample.pptx"):
+        shutil.copyfile(FIXTURES_DIR / fixture, documents_dir / fixture)
+
+    scenarios = build_scenarios(args, documents_dir)
+    if args.list:
+        print("\n".join(scenarios))
+        shutil.rmtree(workdir, ignore_errors=True)
+        return 0
+    names = list(scenarios) if args.scenarios == "all" else [name.strip() for name in args.scenarios.split(",")]
+    unknown = [name for name in names if name not in scenarios]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)} (see --list)", file=sys.stderr)
+        return 2
+    selected = [scenarios[name] for name in names]
+    if not find_libreoffice():
+        skipped = [s.name for s in selected if s.needs_libreoffice]
+        if skipped:
+            print(f"LibreOffice not found, skipping {', '.join(skipped)}", file=sys.stderr)
+        selected = [s for s in selected if not s.needs_libreoffice]
+
+    fake_config: FakeESConfig = config_from_args(args)
+    fake_process, es_url = start_fake_es(fake_config)
+
+    # The apps read their configuration from the environment at import time
+    os.environ["ES_HOST"] = es_url
+    os.environ["SEARCH_CACHE_GENERATION_FILE"] = str(workdir / "search_cache_generation")
+    os.environ["PREVIEW_CACHE_DIR"] = str(workdir / "preview_cache")
+    if not args.with_cache:
+        os.environ["SEARCH_CACHE_MAX_ENTRIES"] = "0"
+        os.environ["FACET_CACHE_MAX_ENTRIES"] = "0"
+    sys.path.insert(0, str(REPO_ROOT))
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    (workdir / "logs").mkdir()  # search.py logs to logs/app.log
+    if not args.app_logs:
+        logging.disable(logging.INFO)  # per-request log lines would drown the report
+
+    results: List[Result] = []
+    try:
+        search_scenarios = [s for s in selected if s.app == "search"]
+        preview_scenarios = [s for s in selected if s.app == "preview"]
+        if search_scenarios:
+            results += asyncio.run(run_app_scenarios(load_search_app(), search_scenarios, args, es_url))
+        if preview_scenarios:
+            app = load_preview_app(documents_dir)
+            results += asyncio.run(run_app_scenarios(app, preview_scenarios, args, es_url))
+    finally:
+        fake_process.terminate()
+        os.chdir(original_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(results)
+    if args.json_path:
+        settings = {k: v for k, v in vars(args).items() if k not in ("json_path", "list")}
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": [asdict(r) for r in results]}, f, indent=2)
+    return 1 if any(r.errors for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Content-hash deduplication for ingestion.
+
+The first document seen with a given Hash is canonical: it is extracted and
+indexed with its text. Later documents with the same Hash are indexed with
+their own metadata but without Text/TransliteratedText, and point at the
+canonical document through CanonicalPropId (GET /documents/{prop_id}
+resolves it). The Hash -> canonical PropId map lives in the ingest manifest,
+so duplicates are recognised across runs too.
+"""
+import logging
+from typing import Iterable, Iterator
+
+from ingest_manifest import IngestManifest
+
+
+logger = logging.getLogger(__name__)
+
+
+CANONICAL_FIELD = "CanonicalPropId"
+# Stored once, on the canonical document
+DEDUPLICATED_FIELDS = ("Text", "TransliteratedText")
+
+
+class DedupStats:
+    def __init__(self):
+        self.unique = 0
+        self.duplicates = 0
+        self.unhashed = 0  # no Hash and no readable file; always stored in full
+
+    def ratio(self) -> float:
+        hashed = self.unique + self.duplicates
+        return self.duplicates / hashed if hashed else 0.0
+
+
+class Deduplicator:
+    def __init__(self, manifest: IngestManifest):
+        self.manifest = manifest
+        self.stats = DedupStats()
+
+    def dedupe_records(self, records: Iterable[dict]) -> Iterator[dict]:
+        """
+        Strips the text fields from duplicates and marks them with
+        CanonicalPropId. Runs before text extraction, which skips them.
+        """
+        for record in records:
+            content_hash = record.get("Hash")
+            prop_id = record.get("PropId")
+            if not content_hash or not prop_id:
+                self.stats.unhashed += 1
+                yield record
+                continue
+            canonical = self.manifest.canonical_for(content_hash, str(prop_id))
+            if canonical == str(prop_id):
+                self.stats.unique += 1
+                record.pop(CANONICAL_FIELD, None)
+            else:
+                self.stats.duplicates += 1
+                for field in DEDUPLICATED_FIELDS:
+                    record.pop(field, None)
+                record[CANONICAL_FIELD] = canonical
+            yield record
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from fastapi import HTTPException
+
+
+logger = logging.getLogger(__name__)
+
+
+CONVERSION_MAX_PARALLEL = int(os.getenv("CONVERSION_MAX_PARALLEL", "2"))
+CONVERSION_MAX_QUEUE = int(os.getenv("CONVERSION_MAX_QUEUE", "16"))        # requests allowed to wait for a slot
+CONVERSION_QUEUE_TIMEOUT = float(os.getenv("CONVERSION_QUEUE_TIMEOUT", "30"))  # max seconds spent waiting for a slot
+CONVERSION_RETRY_AFTER = int(os.getenv("CONVERSION_RETRY_AFTER", "10"))
+
+
+class ConversionLimiter:
+    """
+    Runs blocking conversion jobs on a dedicated thread pool so they never stall
+    the event loop. At most `max_parallel` jobs run at once and at most
+    `max_queue` more wait for a slot; beyond that callers get a 503 with Retry-After.
+
+    Per-job timeouts are enforced by the job itself (subprocess timeout or the
+    LibreOffice pool watchdog), since a running thread cannot be cancelled.
+    """
+
+    def __init__(self, max_parallel: int = CONVERSION_MAX_PARALLEL, max_queue: int = CONVERSION_MAX_QUEUE,
+                 queue_timeout: float = CONVERSION_QUEUE_TIMEOUT, retry_after: int = CONVERSION_RETRY_AFTER):
+        self.max_parallel = max_parallel
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._slots = asyncio.Semaphore(max_parallel)
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="conversion")
+        self.waiting = 0
+        self.running = 0
+
+    def _busy(self, reason: str) -> HTTPException:
+        logger.warning(f"Rejecting conversion: {reason} (running={self.running}, waiting={self.waiting})")
+        return HTTPException(
+            status_code=503,
+            detail="The preview service is busy, please retry shortly.",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        if not self._slots.locked():
+            await self._slots.acquire()  # free slot, returns without suspending
+        else:
+            if self.waiting >= self.max_queue:
+                raise self._busy("wait queue is full")
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise self._busy(f"no slot became free within {self.queue_timeout}s")
+            finally:
+                self.waiting -= 1
+
+        self.running += 1
+        loop = asyncio.get_running_loop()
+        try:
+            job = self._executor.submit(partial(func, *args, **kwargs))
+        except BaseException:
+            self._release()
+            raise
+        # Free the slot when the thread is really done, even if the request was
+        # cancelled (client went away) while the job was still running.
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(job)
+
+    def _release(self) -> None:
+        self.running -= 1
+        self._slots.release()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
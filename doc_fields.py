@@ -0,0 +1,26 @@
+import re
+from typing import List
+
+
+# Attachments is stored as one string of paths separated by "," or "@@@@"
+ATTACHMENT_SEPARATORS_RE = re.compile(r",|@@@@")
+
+
+def split_attachment_paths(attachments: str) -> List[str]:
+    """
+    Splits an Attachments string into its non-empty, stripped paths.
+    """
+    if not attachments:
+        return []
+    return [part.strip() for part in ATTACHMENT_SEPARATORS_RE.split(attachments) if part.strip()]
+
+
+def add_attachment_fields(source: dict) -> dict:
+    """
+    Adds the fields derived from Attachments at ingest time, so search never
+    has to parse the string: AttachmentPaths (keyword array) and AttachmentCount.
+    """
+    paths = split_attachment_paths(source.get("Attachments", ""))
+    source["AttachmentPaths"] = paths
+    source["AttachmentCount"] = len(paths)
+    return source
@@ -0,0 +1,99 @@
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+
+logger = logging.getLogger(__name__)
+
+
+# Connection pool configuration (override through the environment)
+ES_POOL_MAX_CONNECTIONS = int(os.getenv("ES_POOL_MAX_CONNECTIONS", "100"))
+ES_POOL_MAX_KEEPALIVE = int(os.getenv("ES_POOL_MAX_KEEPALIVE", "20"))
+ES_KEEPALIVE_EXPIRY = float(os.getenv("ES_KEEPALIVE_EXPIRY", "30"))
+ES_HTTP2 = os.getenv("ES_HTTP2", "false").lower() in ("1", "true", "yes")
+
+ES_CONNECT_TIMEOUT = float(os.getenv("ES_CONNECT_TIMEOUT", "2.0"))
+ES_POOL_TIMEOUT = float(os.getenv("ES_POOL_TIMEOUT", "5.0"))
+
+# Per-operation timeouts, passed on each request
+ES_SEARCH_TIMEOUT = httpx.Timeout(
+    float(os.getenv("ES_SEARCH_TIMEOUT", "10.0")),
+    connect=ES_CONNECT_TIMEOUT,
+    pool=ES_POOL_TIMEOUT,
+)
+ES_ATTACHMENT_TIMEOUT = httpx.Timeout(
+    float(os.getenv("ES_ATTACHMENT_TIMEOUT", "10.0")),
+    connect=ES_CONNECT_TIMEOUT,
+    pool=ES_POOL_TIMEOUT,
+)
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401  (needed by httpx for HTTP/2)
+    except ImportError:
+        return False
+    return True
+
+
+def create_es_client() -> httpx.AsyncClient:
+    """
+    Builds the pooled client used for every Elasticsearch call.
+    """
+    http2 = ES_HTTP2
+    if http2 and not _http2_available():
+        logger.warning("ES_HTTP2 is enabled but the 'h2' package is not installed, falling back to HTTP/1.1")
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=ES_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=ES_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=ES_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=ES_SEARCH_TIMEOUT, http2=http2)
+
+
+def get_es_client() -> httpx.AsyncClient:
+    """
+    Returns the application-lifetime client. Only valid inside the app lifespan.
+    """
+    if _client is None:
+        raise RuntimeError("Elasticsearch client is not started; is the app lifespan running?")
+    return _client
+
+
+async def start_es_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = create_es_client()
+        logger.info(
+            f"Elasticsearch client started (max_connections={ES_POOL_MAX_CONNECTIONS}, "
+            f"keepalive={ES_POOL_MAX_KEEPALIVE}, http2={ES_HTTP2})"
+        )
+    return _client
+
+
+async def close_es_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Elasticsearch client closed")
+
+
+@asynccontextmanager
+async def es_lifespan(app):
+    """
+    FastAPI lifespan hook: one pooled client for the lifetime of the app.
+    """
+    await start_es_client()
+    try:
+        yield
+    finally:
+        await close_es_client()
@@ -1,276 +1,435 @@
+"""
+Bulk ingestion into the document index.
+
+    python es_doc_ingest.py sample_docs.jsonl
+    python es_doc_ingest.py /data/manifests --threads 8 --chunk-size 1000
+
+Sources are JSONL/NDJSON or CSV files (one document per line/row), or
+directories that are searched recursively for such files. Records are
+streamed: nothing holds the full input in memory.
+
+Records without Text get it extracted from the file at SystemPath
+(PDF/DOCX/XLSX/TXT) in a process pool, see text_extraction.py.
+
+Runs are incremental: a local manifest (ingest_manifest.py) remembers what
+was indexed, so only new or changed documents are extracted and sent.
+--full re-sends everything. With --delete-missing, documents missing from
+the input are deleted too, unless the run had failures, a source could not
+be read, or more than --max-delete-ratio of the indexed documents would go
+(--force-delete overrides the ratio).
+
+Documents sharing a content Hash have their text extracted and stored once,
+see content_dedup.py.
+
+Refresh and replicas are turned off during the load only for an index the
+run creates, or with --bulk-settings (large backfills into an existing index).
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
 from elasticsearch import Elasticsearch, helpers
 
-es = Elasticsearch("http://localhost:9200")
-
-INDEX_NAME = "document_index"
-
-documents = [
-  {
-    "ProphecyId": "PROP001",
-    "ParentProphecyId": "",
-    "Text": "Main document about financial markets and trends.",
-    "IsAttachment": "False",
-    "DocumentDate": 1719792000000,
-    "DocType": "Report",
-    "Branch": "New York",
-    "FileExtension": "pdf"
-  },
-  {
-    "ProphecyId": "PROP002",
-    "ParentProphecyId": "PROP001",
-    "Text": "Attachment with detailed financial tables.",
-    "IsAttachment": "True",
-    "DocumentDate": 1719878400000,
-    "DocType": "Attachment",
-    "Branch": "New York",
-    "FileExtension": "xlsx"
-  },
-  {
-    "ProphecyId": "PROP003",
-    "ParentProphecyId": "",
-    "Text": "Quarterly market analysis overview.",
-    "IsAttachment": "False",
-    "DocumentDate": 1719964800000,
-    "DocType": "Analysis",
-    "Branch": "London",
-    "FileExtension": "docx"
-  },
-  {
-    "ProphecyId": "PROP004",
-    "ParentProphecyId": "PROP003",
-    "Text": "Supporting charts and graphs for analysis.",
-    "IsAttachment": "True",
-    "DocumentDate": 1720051200000,
-    "DocType": "Attachment",
-    "Branch": "London",
-    "FileExtension": "pptx"
-  },
-  {
-    "ProphecyId": "PROP005",
-    "ParentProphecyId": "",
-    "Text": "Annual report summary.",
-    "IsAttachment": "False",
-    "DocumentDate": 1720137600000,
-    "DocType": "Summary",
-    "Branch": "Tokyo",
-    "FileExtension": "pdf"
-  },
-  {
-    "ProphecyId": "PROP006",
-    "ParentProphecyId": "PROP005",
-    "Text": "Detailed appendix for annual report.",
-    "IsAttachment": "True",
-    "DocumentDate": 1720224000000,
-    "DocType": "Attachment",
-    "Branch": "Tokyo",
-    "FileExtension": "pdf"
-  },
-  {
-    "ProphecyId": "PROP007",
-    "ParentProphecyId": "",
-    "Text": "Special financial forecast document.",
-    "IsAttachment": "False",
-    "DocumentDate": 1720310400000,
-    "DocType": "Forecast",
-    "Branch": "New York",
-    "FileExtension": "xlsx"
-  },
-  {
-    "ProphecyId": "PROP008",
-    "ParentProphecyId": "PROP007",
-    "Text": "Spreadsheet with forecast data.",
-    "IsAttachment": "True",
-    "DocumentDate": 1720396800000,
-    "DocType": "Attachment",
-    "Branch": "New York",
-    "FileExtension": "xlsx"
-  },
-  {
-    "ProphecyId": "PROP009",
-    "ParentProphecyId": "",
-    "Text": "Internal memo regarding market risks.",
-    "IsAttachment": "False",
-    "DocumentDate": 1720483200000,
-    "DocType": "Memo",
-    "Branch": "London",
-    "FileExtension": "docx"
-  },
-  {
-    "ProphecyId": "PROP010",
-    "ParentProphecyId": "PROP009",
-    "Text": "Risk assessment charts.",
-    "IsAttachment": "True",
-    "DocumentDate": 1720569600000,
-    "DocType": "Attachment",
-    "Branch": "London",
-    "FileExtension": "pdf"
-  },
-  {
-    "ProphecyId": "PROP011",
-    "ParentProphecyId": "",
-    "Text": "Marketing strategy document.",
-    "IsAttachment": "False",
-    "DocumentDate": 1720656000000,
-    "DocType": "Strategy",
-    "Branch": "Tokyo",
-    "FileExtension": "pptx"
-  },
-  {
-    "ProphecyId": "PROP012",
-    "ParentProphecyId": "PROP011",
-    "Text": "Presentation slides for marketing.",
-    "IsAttachment": "True",
-    "DocumentDate": 1720742400000,
-    "DocType": "Attachment",
-    "Branch": "Tokyo",
-    "FileExtension": "pptx"
-  },
-  {
-    "ProphecyId": "PROP013",
-    "ParentProphecyId": "",
-    "Text": "Compliance guidelines document.",
-    "IsAttachment": "False",
-    "DocumentDate": 1720828800000,
-    "DocType": "Guideline",
-    "Branch": "New York",
-    "FileExtension": "pdf"
-  },
-  {
-    "ProphecyId": "PROP014",
-    "ParentProphecyId": "PROP013",
-    "Text": "Checklist attachment for compliance.",
-    "IsAttachment": "True",
-    "DocumentDate": 1720915200000,
-    "DocType": "Attachment",
-    "Branch": "New York",
-    "FileExtension": "docx"
-  },
-  {
-    "ProphecyId": "PROP015",
-    "ParentProphecyId": "",
-    "Text": "Research paper on market trends.",
-    "IsAttachment": "False",
-    "DocumentDate": 1721001600000,
-    "DocType": "Research",
-    "Branch": "London",
-    "FileExtension": "pdf"
-  },
-  {
-    "ProphecyId": "PROP016",
-    "ParentProphecyId": "PROP015",
-    "Text": "Data sets attachment for research.",
-    "IsAttachment": "True",
-    "DocumentDate": 1721088000000,
-    "DocType": "Attachment",
-    "Branch": "London",
-    "FileExtension": "csv"
-  },
-  {
-    "ProphecyId": "PROP017",
-    "ParentProphecyId": "",
-    "Text": "Executive summary document.",
-    "IsAttachment": "False",
-    "DocumentDate": 1721174400000,
-    "DocType": "Summary",
-    "Branch": "Tokyo",
-    "FileExtension": "pdf"
-  },
-  {
-    "ProphecyId": "PROP018",
-    "ParentProphecyId": "PROP017",
-    "Text": "Supporting notes attachment.",
-    "IsAttachment": "True",
-    "DocumentDate": 1721260800000,
-    "DocType": "Attachment",
-    "Branch": "Tokyo",
-    "FileExtension": "txt"
-  },
-  {
-    "ProphecyId": "PROP019",
-    "ParentProphecyId": "",
-    "Text": "Budget planning document.",
-    "IsAttachment": "False",
-    "DocumentDate": 1721347200000,
-    "DocType": "Plan",
-    "Branch": "New York",
-    "FileExtension": "xlsx"
-  },
-  {
-    "ProphecyId": "PROP020",
-    "ParentProphecyId": "PROP019",
-    "Text": "Budget spreadsheets attachment.",
-    "IsAttachment": "True",
-    "DocumentDate": 1721433600000,
-    "DocType": "Attachment",
-    "Branch": "New York",
-    "FileExtension": "xlsx"
-  }
-]
-
-# For brevity, here's how to wrap each dict from above into bulk action:
-bulk_docs = [
-  {
-        "_index": INDEX_NAME,
-        "_source": {
-            "PropId": "abcd1",
-            "ParentPropId": "xyz",
-            "IsAttachment": "True",
-            "SystemPath": r"C:\Users\Admin\Desktop\try\llm-applications-meta.jpg",
-            "Branch": "telecom",
-            "DocType": "analysis",
-            "Text": "",
-            "DocumentDate": 1751615191,
-            "DocumentFrom": "Manager",
-            "DocumentTo": "emp1",
-            "Attachments": ""
-        }
-    },
-    {
-        "_index": INDEX_NAME,
-        "_source": {
-            "PropId": "xyz",
-            "ParentPropId": "",
-            "IsAttachment": "False",
-            "SystemPath": r"C:\Users\Admin\Desktop\try\micro.pdf",
-            "Branch": "telecom",
-            "DocType": "analysis",
-            "Text": (
-                "Think of any society. People in the society need many goods and "
-                "services in their everyday life including food, clothing, shelter, "
-                "transport facilities like roads and railways, postal services and "
-                "various other services like that of teachers and doctors."
-            ),
-            "DocumentDate": 1751615010,
-            "DocumentFrom": "Manager",
-            "DocumentTo": "emp1",
-            "Attachments": r"C:\Users\Admin\Desktop\try\llm-applications-meta.jpg"
-        }
-    },
-      {
-        "_index": INDEX_NAME,
-        "_source": {
-            "PropId": "xyz2",
-            "ParentPropId": "",
-            "IsAttachment": "False",
-            "SystemPath": r"C:\Users\Admin\Desktop\try\leec101.pdf",
-            "Branch": "telecom",
-            "DocType": "analysis",
-            "Text": (
-                " You must have already been introduced to a study of basic "
-                "this is market society"
-            ),
-            "DocumentDate": 1751615000,
-            "DocumentFrom": "Manager",
-            "DocumentTo": "emp1",
-            "Attachments": ""
-        }
-    },
-
-    
-]
-
-
-
-# Bulk upload
-response = helpers.bulk(es, bulk_docs)
-print("Bulk ingestion response:", response)
+from content_dedup import Deduplicator
+from doc_fields import add_attachment_fields
+from index_template import install_index_template
+from ingest_manifest import INGEST_MANIFEST, IngestManifest
+from search_cache import bump_search_generation
+from text_extraction import EXTRACT_MAX_MEMORY_MB, EXTRACT_TIMEOUT, EXTRACT_WORKERS, TextExtractor
+
+
+logger = logging.getLogger("es_doc_ingest")
+
+
+ES_URL = os.getenv("ES_URL", "http://localhost:9200")
+INDEX_NAME = os.getenv("ES_INDEX", "document_index")
+
+RECORD_SUFFIXES = {".jsonl", ".ndjson", ".csv"}
+# CSV values arrive as strings; these fields are stored as numbers
+NUMERIC_FIELDS = {"DocumentDate", "CreationDate", "ModifiedDate", "IngestionDate", "FileSize"}
+
+# --delete-missing refuses to remove more than this share of the tracked documents without --force-delete
+MAX_DELETE_RATIO = float(os.getenv("INGEST_MAX_DELETE_RATIO", "0.1"))
+
+# Settings switched off for the duration of a bulk load, then restored
+BULK_LOAD_SETTINGS = {"index.refresh_interval": "-1", "index.number_of_replicas": 0}
+
+
+# --- Reading records -------------------------------------------------------
+def iter_source_files(paths: Iterable[str], problems: Optional[List[str]] = None) -> Iterator[Path]:
+    """
+    Files to read. Sources that are missing or hold no record files are
+    logged and appended to `problems`.
+    """
+    problems = problems if problems is not None else []
+    for raw in paths:
+        path = Path(raw)
+        if path.is_dir():
+            found = False
+            for child in sorted(path.rglob("*")):
+                if child.is_file() and child.suffix.lower() in RECORD_SUFFIXES:
+                    found = True
+                    yield child
+            if not found:
+                logger.warning(f"No record files under {raw}")
+                problems.append(f"{raw}: no record files")
+        elif path.is_file():
+            yield path
+        else:
+            logger.warning(f"Skipping {raw}: not a file or directory")
+            problems.append(f"{raw}: not a file or directory")
+
+
+def _coerce_csv_row(row: Dict[str, str]) -> dict:
+    record = {}
+    for key, value in row.items():
+        if key in NUMERIC_FIELDS and value not in (None, ""):
+            try:
+                record[key] = int(value)
+                continue
+            except ValueError:
+                pass
+        record[key] = value
+    return record
+
+
+def _read_file(path: Path, problems: List[str]) -> Iterator[dict]:
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                yield _coerce_csv_row(row)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.error(f"{path}:{line_no}: invalid JSON ({e}), skipped")
+                    problems.append(f"{path}:{line_no}: invalid JSON")
+
+
+def iter_records(paths: Iterable[str], problems: Optional[List[str]] = None) -> Iterator[dict]:
+    """
+    Records from every source. Unreadable files and lines are logged, skipped
+    and appended to `problems` (a run with problems does not delete documents).
+    """
+    problems = problems if problems is not None else []
+    for path in iter_source_files(paths, problems):
+        logger.info(f"Reading {path}")
+        try:
+            yield from _read_file(path, problems)
+        except (OSError, UnicodeDecodeError, csv.Error) as e:
+            logger.error(f"Could not read {path}: {e}")
+            problems.append(f"{path}: {e}")
+
+
+def iter_actions(records: Iterable[dict], index: str) -> Iterator[dict]:
+    for record in records:
+        action = {"_index": index, "_source": add_attachment_fields(record)}
+        if record.get("PropId"):
+            action["_id"] = record["PropId"]  # re-ingesting a document overwrites it
+        yield action
+
+
+def iter_chunks(actions: Iterable[dict], chunk_size: int, max_chunk_bytes: int) -> Iterator[List[dict]]:
+    """
+    Groups actions into lists bounded by count and (approximate) serialized size.
+    """
+    chunk: List[dict] = []
+    chunk_bytes = 0
+    for action in actions:
+        size = len(json.dumps(action["_source"])) + 64
+        if chunk and (len(chunk) >= chunk_size or chunk_bytes + size > max_chunk_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(action)
+        chunk_bytes += size
+    if chunk:
+        yield chunk
+
+
+# --- Index settings --------------------------------------------------------
+def ensure_index(es: Elasticsearch, index: str) -> bool:
+    """
+    Creates the index if neither an index nor an alias has that name; returns
+    whether it was created.
+    """
+    if es.indices.exists(index=index):
+        return False
+    es.indices.create(index=index)
+    logger.info(f"Created index {index}")
+    return True
+
+
+def apply_bulk_load_settings(es: Elasticsearch, index: str) -> Dict[str, Dict[str, Optional[str]]]:
+    """
+    Disables refresh and replicas for the load; returns the previous values
+    per concrete index (`index` may be an alias).
+    """
+    response = es.indices.get_settings(index=index, flat_settings=True)
+    previous = {
+        name: {setting: entry["settings"].get(setting) for setting in BULK_LOAD_SETTINGS}
+        for name, entry in response.items()
+    }
+    es.indices.put_settings(index=index, settings=BULK_LOAD_SETTINGS)
+    logger.info(f"Bulk load settings applied to {index} (previous: {previous})")
+    return previous
+
+
+def restore_settings(es: Elasticsearch, previous: Dict[str, Dict[str, Optional[str]]]) -> None:
+    # None resets a setting to the index default
+    for name, settings in previous.items():
+        es.indices.put_settings(index=name, settings=settings)
+        es.indices.refresh(index=name)
+        logger.info(f"Restored settings on {name}: {settings}")
+
+
+# --- Bulk indexing ---------------------------------------------------------
+class IngestStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.indexed = 0
+        self.failed = 0
+
+    def add(self, indexed: int, failed: int) -> None:
+        with self.lock:
+            self.indexed += indexed
+            self.failed += failed
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.indexed / elapsed if elapsed > 0 else 0.0
+
+
+def send_chunk(es: Elasticsearch, chunk: List[dict], stats: IngestStats,
+               max_retries: int, initial_backoff: float, max_backoff: float,
+               on_indexed: Optional[Callable[[List[str]], None]] = None) -> None:
+    """
+    Indexes one chunk. streaming_bulk retries documents rejected with 429
+    with exponential backoff; other per-document errors are logged and counted.
+    `on_indexed` receives the _ids ES accepted.
+    """
+    indexed_ids: List[str] = []
+    indexed = failed = 0
+    for ok, item in helpers.streaming_bulk(
+        es, chunk, chunk_size=len(chunk), max_chunk_bytes=sys.maxsize,
+        max_retries=max_retries, initial_backoff=initial_backoff, max_backoff=max_backoff,
+        raise_on_error=False, raise_on_exception=False,
+    ):
+        if ok:
+            indexed += 1
+            doc_id = next(iter(item.values())).get("_id")
+            if doc_id is not None:
+                indexed_ids.append(doc_id)
+        else:
+            failed += 1
+            logger.error(f"Failed to index document: {item}")
+    stats.add(indexed, failed)
+    if on_indexed is not None and indexed_ids:
+        on_indexed(indexed_ids)
+
+
+def bulk_index(es: Elasticsearch, actions: Iterable[dict], threads: int, chunk_size: int, max_chunk_bytes: int,
+               max_retries: int, initial_backoff: float, max_backoff: float,
+               on_indexed: Optional[Callable[[List[str]], None]] = None,
+               report_every: float = 10.0) -> IngestStats:
+    """
+    Sends chunks from `threads` worker threads. At most 2 chunks per thread are
+    queued at any time, so memory stays bounded however large the input is.
+    """
+    stats = IngestStats()
+    in_flight = threading.BoundedSemaphore(threads * 2)
+    errors: List[BaseException] = []
+    last_report = time.monotonic()
+
+    def run(chunk: List[dict]) -> None:
+        try:
+            send_chunk(es, chunk, stats, max_retries, initial_backoff, max_backoff, on_indexed)
+        except BaseException as e:  # surfaced after the pool drains
+            errors.append(e)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="bulk") as pool:
+        for chunk in iter_chunks(actions, chunk_size, max_chunk_bytes):
+            if errors:
+                break
+            in_flight.acquire()
+            pool.submit(run, chunk)
+            if time.monotonic() - last_report >= report_every:
+                last_report = time.monotonic()
+                logger.info(f"{stats.indexed} indexed, {stats.failed} failed, {stats.rate():.0f} docs/sec")
+
+    if errors:
+        raise errors[0]
+    return stats
+
+
+def deletion_blocker(removed: int, tracked: int, failed: int, problems: List[str],
+                     max_ratio: float, force: bool) -> Optional[str]:
+    """
+    Why documents missing from this run must not be deleted, or None if they may be.
+    """
+    if failed:
+        return f"{failed} documents failed to index"
+    if problems:
+        return f"{len(problems)} sources or lines could not be read (first: {problems[0]})"
+    if not force and tracked and removed / tracked > max_ratio:
+        return (f"{removed} of {tracked} indexed documents ({removed / tracked:.0%}) are missing from the input, "
+                f"more than --max-delete-ratio {max_ratio:.0%}; check the sources or pass --force-delete")
+    return None
+
+
+def delete_documents(es: Elasticsearch, index: str, doc_ids: List[str], chunk_size: int) -> List[str]:
+    """
+    Deletes documents by _id; returns the ids that are gone (including ones
+    that were already missing from the index).
+    """
+    actions = ({"_op_type": "delete", "_index": index, "_id": doc_id} for doc_id in doc_ids)
+    deleted = []
+    for ok, item in helpers.streaming_bulk(es, actions, chunk_size=chunk_size,
+                                           raise_on_error=False, raise_on_exception=False):
+        result = item["delete"]
+        if ok or result.get("status") == 404:
+            deleted.append(result["_id"])
+        else:
+            logger.error(f"Failed to delete document: {item}")
+    return deleted
+
+
+# --- CLI -------------------------------------------------------------------
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Stream documents into Elasticsearch.")
+    parser.add_argument("sources", nargs="+", help="JSONL/NDJSON/CSV files or directories of them")
+    parser.add_argument("--es-url", default=ES_URL)
+    parser.add_argument("--index", default=INDEX_NAME)
+    parser.add_argument("--threads", type=int, default=4, help="parallel bulk requests")
+    parser.add_argument("--chunk-size", type=int, default=500, help="documents per bulk request")
+    parser.add_argument("--max-chunk-bytes", type=int, default=10 * 1024 * 1024, help="bytes per bulk request")
+    parser.add_argument("--max-retries", type=int, default=8, help="retries for documents rejected with 429")
+    parser.add_argument("--initial-backoff", type=float, default=2.0, help="seconds before the first 429 retry")
+    parser.add_argument("--max-backoff", type=float, default=120.0)
+    parser.add_argument("--manifest", default=INGEST_MANIFEST, help="SQLite file tracking what has been indexed")
+    parser.add_argument("--full", action="store_true", help="re-send every document, not only new/changed ones")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="delete documents indexed earlier that this run's input no longer contains "
+                             "(only pass the complete set of sources)")
+    parser.add_argument("--max-delete-ratio", type=float, default=MAX_DELETE_RATIO,
+                        help="with --delete-missing, refuse to delete more than this share of the indexed documents")
+    parser.add_argument("--force-delete", action="store_true", help="delete even above --max-delete-ratio")
+    parser.add_argument("--no-dedup", action="store_true", help="store the text of every document, even duplicates")
+    parser.add_argument("--no-extract", action="store_true", help="index records as they are, without extracting Text")
+    parser.add_argument("--extract-workers", type=int, default=EXTRACT_WORKERS, help="text extraction processes")
+    parser.add_argument("--extract-timeout", type=float, default=EXTRACT_TIMEOUT, help="seconds per file")
+    parser.add_argument("--extract-max-memory-mb", type=int, default=EXTRACT_MAX_MEMORY_MB,
+                        help="address space limit per extraction process (0: unlimited)")
+    parser.add_argument("--skip-template", action="store_true",
+                        help="do not install/update the index template before creating the index")
+    parser.add_argument("--bulk-settings", action="store_true",
+                        help="turn off refresh and replicas during the load, then restore them "
+                             "(always done for an index this run creates); for large backfills, "
+                             "not for incremental runs against a live index")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    args = parse_args(argv)
+
+    es = Elasticsearch(
+        args.es_url, request_timeout=120, max_retries=args.max_retries,
+        retry_on_status=(429, 502, 503, 504), retry_on_timeout=True,
+    )
+    if not args.skip_template:
+        install_index_template(es, args.index)
+    created = ensure_index(es, args.index)
+
+    extractor = None if args.no_extract else TextExtractor(
+        workers=args.extract_workers, timeout=args.extract_timeout, max_memory_mb=args.extract_max_memory_mb,
+    )
+    manifest = IngestManifest(args.manifest, args.index, full=args.full)
+    dedup = Deduplicator(manifest)
+    previous_settings = apply_bulk_load_settings(es, args.index) if args.bulk_settings or created else None
+    try:
+        with ExitStack() as stack:
+            stack.enter_context(manifest)
+            if extractor is not None:
+                stack.enter_context(extractor)
+
+            def send(records: Iterable[dict]) -> IngestStats:
+                # Unchanged records and duplicates are handled before extraction,
+                # so their files are never parsed
+                records = manifest.changed_records(records)
+                if not args.no_dedup:
+                    records = dedup.dedupe_records(records)
+                if extractor is not None:
+                    records = extractor.extract_records(records)
+                return bulk_index(
+                    es, iter_actions(records, args.index),
+                    threads=args.threads, chunk_size=args.chunk_size, max_chunk_bytes=args.max_chunk_bytes,
+                    max_retries=args.max_retries, initial_backoff=args.initial_backoff,
+                    max_backoff=args.max_backoff, on_indexed=manifest.mark_indexed,
+                )
+
+            problems: List[str] = []
+            stats = send(iter_records(args.sources, problems))
+            removed = manifest.removed_prop_ids()
+            if removed and not args.delete_missing:
+                logger.info(f"{len(removed)} documents indexed earlier are missing from the input; "
+                            f"kept (pass --delete-missing to remove them)")
+            elif removed:
+                blocker = deletion_blocker(len(removed), manifest.tracked_count(), stats.failed, problems,
+                                           args.max_delete_ratio, args.force_delete)
+                if blocker is not None:
+                    logger.warning(f"Not deleting {len(removed)} documents missing from the input: {blocker}")
+                else:
+                    deleted = delete_documents(es, args.index, removed, args.chunk_size)
+                    manifest.forget(deleted)
+                    logger.info(f"Deleted {len(deleted)} of {len(removed)} documents missing from the input")
+            # Duplicates whose canonical document changed or was deleted would
+            # otherwise point at the wrong text until their own next change
+            requeued = manifest.requeue_released()
+            if requeued:
+                logger.info(f"Re-sending {len(requeued)} duplicates whose canonical document changed or was removed")
+                resent = send(record for record in iter_records(args.sources)
+                              if str(record.get("PropId")) in requeued)
+                stats.add(resent.indexed, resent.failed)
+    finally:
+        if previous_settings is not None:
+            restore_settings(es, previous_settings)
+
+    elapsed = time.monotonic() - stats.started
+    logger.info(f"Done: {stats.indexed} indexed, {stats.failed} failed in {elapsed:.1f}s ({stats.rate():.0f} docs/sec)")
+    changes = manifest.stats
+    if problems:
+        logger.warning(f"{len(problems)} sources or lines could not be read")
+    logger.info(f"Manifest: {changes.new} new, {changes.changed} changed, {changes.unchanged} unchanged, "
+                f"{changes.untracked} without PropId")
+    if not args.no_dedup:
+        logger.info(f"Dedup: {dedup.stats.unique} unique, {dedup.stats.duplicates} duplicates, "
+                    f"{dedup.stats.unhashed} without hash (dedup ratio {dedup.stats.ratio():.1%})")
+    if extractor is not None:
+        extracted = extractor.stats
+        logger.info(f"Text extraction: {extracted.extracted} extracted, {extracted.failed} failed, "
+                    f"{extracted.skipped} unsupported file types")
+
+    # Cached search results may now be stale
+    logger.info(f"Search cache generation: {bump_search_generation()}")
+    return 1 if stats.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import html
+import re
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+
+# A complete <img ...> tag; quoted attribute values may contain '>'
+IMG_TAG_RE = re.compile(r"""<img\b(?:[^>"']|"[^"]*"|'[^']*')*>""", re.IGNORECASE)
+IMG_START_RE = re.compile(r"<img\b", re.IGNORECASE)
+# One attribute: name, optionally "=" and a double-quoted, single-quoted or bare value
+ATTR_RE = re.compile(r"""\s*([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# An <img tag still open after this many characters (never closed, or an
+# unbalanced quote) is passed through unchanged instead of buffering the rest
+# of the document; large enough for inline data: URIs
+MAX_IMG_TAG_CHARS = 1024 * 1024
+
+
+def iter_text_chunks(path: Path, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Reads a text file in fixed-size chunks (UTF-8, undecodable bytes replaced).
+    """
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            yield chunk
+
+
+def find_src_attr(tag: str) -> Optional["re.Match"]:
+    """
+    The src attribute of an <img ...> tag, found by walking its attributes in
+    order, so "src=" inside another attribute's value is not mistaken for it.
+    Like browsers, the first src wins.
+    """
+    pos = len("<img")
+    while pos < len(tag):
+        match = ATTR_RE.match(tag, pos)
+        if match is None:
+            if tag[pos] in "/\"'=" or tag[pos].isspace():
+                pos += 1  # stray characters, e.g. the "/" of "<img ... />"
+                continue
+            break  # ">"
+        if match.group(1).lower() == "src" and match.lastindex and match.lastindex > 1:
+            return match
+        pos = match.end()
+    return None
+
+
+def rewrite_img_tag(tag: str, rewrite_src: Callable[[str], Optional[str]]) -> str:
+    """
+    Returns `tag` with its src attribute replaced by rewrite_src(src).
+    The tag is returned unchanged when it has no src or rewrite_src returns None.
+    """
+    match = find_src_attr(tag)
+    if match is None:
+        return tag
+    raw_value = next(group for group in match.groups()[1:] if group is not None)
+    new_src = rewrite_src(html.unescape(raw_value))
+    if new_src is None:
+        return tag
+    return f'{tag[:match.start(1)]}src="{html.escape(new_src, quote=True)}"{tag[match.end():]}'
+
+
+def rewrite_img_sources(chunks: Iterable[str], rewrite_src: Callable[[str], Optional[str]]) -> Iterator[str]:
+    """
+    Streams HTML through, rewriting the src of every <img> tag and passing
+    everything else through untouched. Only an unfinished tag at a chunk
+    boundary is held back (up to MAX_IMG_TAG_CHARS), so memory stays bounded.
+    """
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        pos = 0
+        while True:
+            start = IMG_START_RE.search(pending, pos)
+            if start is None:
+                # Hold back a trailing "<", "<i", "<im" that may start an <img> tag
+                cut = pending.rfind("<", max(pos, len(pending) - 4))
+                cut = len(pending) if cut == -1 else cut
+                if cut > pos:
+                    yield pending[pos:cut]
+                pending = pending[cut:]
+                break
+            tag = IMG_TAG_RE.match(pending, start.start())
+            if tag is None and len(pending) - start.start() > MAX_IMG_TAG_CHARS:
+                # Not a tag we can rewrite; keep scanning right after its "<img"
+                yield pending[pos:start.end()]
+                pos = start.end()
+                continue
+            if tag is None:
+                # The tag continues in the next chunk
+                if start.start() > pos:
+                    yield pending[pos:start.start()]
+                pending = pending[start.start():]
+                break
+            if start.start() > pos:
+                yield pending[pos:start.start()]
+            yield rewrite_img_tag(tag.group(0), rewrite_src)
+            pos = tag.end()
+
+    if pending:
+        # Either plain text or a tag that never closed; pass it through as is
+        yield pending
@@ -0,0 +1,34 @@
+from pathlib import Path
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    True if the request's If-None-Match header names `etag` (or is "*").
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def ranged_file_response(request: Request, path: Path, media_type: str, etag: str,
+                         filename: Optional[str] = None,
+                         cache_control: str = "private, no-cache") -> Response:
+    """
+    Serves a file with ETag/If-None-Match revalidation. Range requests
+    (206/416, multipart ranges, If-Range against `etag`) are left to
+    Starlette's FileResponse, so viewers can fetch large files lazily.
+    """
+    headers: Dict[str, str] = {"ETag": etag, "Cache-Control": cache_control}
+    if filename:
+        headers["Content-Disposition"] = f"inline; filename*=utf-8''{quote(filename)}"
+
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path=path, media_type=media_type, headers=headers)
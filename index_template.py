@@ -0,0 +1,87 @@
+"""
+Index template for the document index.
+
+Installed by es_doc_ingest.py before it creates the index. A template only
+applies when an index is created, so an existing index built with dynamic
+mapping has to be reindexed into a new one to pick these settings up.
+"""
+import logging
+
+from elasticsearch import Elasticsearch
+
+
+logger = logging.getLogger(__name__)
+
+
+TEMPLATE_NAME = "document_index_template"
+
+
+def _keyword(doc_values: bool = False, index: bool = True) -> dict:
+    mapping = {"type": "keyword", "doc_values": doc_values}
+    if not index:
+        mapping["index"] = False
+    return mapping
+
+
+DOCUMENT_MAPPINGS = {
+    "dynamic_templates": [
+        {
+            # Metadata fields that are not listed below: exact-match only,
+            # no doc_values (nothing sorts or aggregates on them)
+            "strings_as_keywords": {
+                "match_mapping_type": "string",
+                "mapping": {"type": "keyword", "ignore_above": 1024, "doc_values": False}
+            }
+        }
+    ],
+    "properties": {
+        # Ids: term lookups; PropId also breaks DocumentDate ties in the sort
+        "PropId": _keyword(doc_values=True),
+        "ParentPropId": _keyword(),
+        "OriginalName": _keyword(),
+        "IsAttachment": _keyword(),
+        "Hash": _keyword(),
+        # Set on content duplicates, which store no text of their own
+        "CanonicalPropId": _keyword(),
+
+        # Facets and filters: need doc_values for the terms aggregations
+        "DocType": _keyword(doc_values=True),
+        "Branch": _keyword(doc_values=True),
+        "FileExtension": _keyword(doc_values=True),
+
+        # Returned to the UI, never queried
+        "SystemPath": _keyword(index=False),
+        "Attachments": _keyword(index=False),
+
+        "AttachmentPaths": _keyword(),
+        "AttachmentCount": {"type": "integer"},
+
+        # Dates are epoch seconds
+        "DocumentDate": {"type": "date", "format": "epoch_second"},
+
+        # Offsets in the postings make highlighting long texts much cheaper
+        "Text": {"type": "text", "index_options": "offsets"},
+        "TransliteratedText": {"type": "text", "index_options": "offsets"},
+    }
+}
+
+DOCUMENT_SETTINGS = {
+    # Matches the /search sort, so ES can stop collecting early and
+    # the index compresses better
+    "index.sort.field": ["DocumentDate", "PropId"],
+    "index.sort.order": ["desc", "asc"],
+}
+
+
+def install_index_template(es: Elasticsearch, index_name: str) -> None:
+    """
+    Creates or updates the composable template covering `index_name` (and
+    suffixed variants such as document_index_v2 used for reindexing).
+    """
+    es.indices.put_index_template(
+        name=TEMPLATE_NAME,
+        index_patterns=[f"{index_name}*"],
+        template={"settings": DOCUMENT_SETTINGS, "mappings": DOCUMENT_MAPPINGS},
+        priority=100,
+    )
+    logger.info(f"Installed index template {TEMPLATE_NAME} for {index_name}*")
@@ -0,0 +1,341 @@
+"""
+Local SQLite manifest of what es_doc_ingest.py has indexed, so repeated runs
+only send new or changed documents and can delete the ones that disappeared.
+
+One row per (index, PropId) with the record's SystemPath, the file's size,
+mtime and content hash, and a hash of the record's metadata. A document is
+re-sent when its metadata changed or its file's content did; a file whose
+size and mtime are unchanged is not read again.
+
+The content hash is the record's own Hash if it has one, else the sha256 of
+the file; records without a Hash get the computed one. Files are hashed in
+a thread pool a window ahead of the records being classified, so a first
+backfill is not limited by one file read at a time. The hash has to be
+known before content_dedup decides whether to extract a file at all, so
+extraction reads the file again (usually from the page cache). The
+manifest also remembers which document holds the text for each hash (see
+content_dedup.py).
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+INGEST_MANIFEST = os.getenv("INGEST_MANIFEST", "ingest_manifest.sqlite3")
+
+HASH_BLOCK_SIZE = 1024 * 1024
+# Threads hashing files ahead of classification (reading + sha256 release the GIL)
+HASH_WORKERS = int(os.getenv("INGEST_HASH_WORKERS", "8"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    index_name   TEXT NOT NULL,
+    prop_id      TEXT NOT NULL,
+    system_path  TEXT,
+    size         INTEGER,
+    mtime_ns     INTEGER,
+    content_hash TEXT,
+    record_hash  TEXT NOT NULL,
+    indexed_at   REAL NOT NULL,
+    last_seen    INTEGER NOT NULL,
+    PRIMARY KEY (index_name, prop_id)
+);
+CREATE TABLE IF NOT EXISTS contents (
+    index_name        TEXT NOT NULL,
+    content_hash      TEXT NOT NULL,
+    canonical_prop_id TEXT NOT NULL,
+    PRIMARY KEY (index_name, content_hash)
+);
+CREATE INDEX IF NOT EXISTS documents_by_hash ON documents (index_name, content_hash);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+    index_name TEXT NOT NULL,
+    started_at REAL NOT NULL
+);
+"""
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_sha256(record: dict) -> str:
+    canonical = json.dumps(record, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _try_file_sha256(path: str) -> Optional[str]:
+    try:
+        return file_sha256(path)
+    except OSError as e:
+        logger.warning(f"Could not hash {path}: {e}")
+        return None
+
+
+def _stat(path: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
+    if not path:
+        return None, None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime_ns
+
+
+class ManifestStats:
+    def __init__(self):
+        self.new = 0
+        self.changed = 0
+        self.unchanged = 0
+        self.untracked = 0  # records without a PropId; always sent
+
+
+class IngestManifest:
+    """
+    Use as a context manager. `changed_records` filters the input; `mark_indexed`
+    (safe to call from the bulk threads) records documents ES accepted, so a
+    document that failed to index is retried on the next run.
+    """
+
+    def __init__(self, path: str, index_name: str, full: bool = False):
+        self.path = path
+        self.index_name = index_name
+        self.full = full  # send every record, but still refresh the manifest
+        self.stats = ManifestStats()
+        self.run_id = None
+        self.started_at = None
+        self._conn = None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, tuple] = {}  # prop_id -> row waiting for ES to accept it
+        self._released: Set[str] = set()  # hashes whose canonical document changed or went away
+
+    def __enter__(self) -> "IngestManifest":
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self.started_at = time.time()
+        cursor = self._conn.execute(
+            "INSERT INTO runs (index_name, started_at) VALUES (?, ?)", (self.index_name, self.started_at)
+        )
+        self.run_id = cursor.lastrowid
+        self._conn.commit()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    def _stored(self, prop_id: str) -> Optional[tuple]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT system_path, size, mtime_ns, content_hash, record_hash FROM documents "
+                "WHERE index_name = ? AND prop_id = ?",
+                (self.index_name, prop_id),
+            ).fetchone()
+
+    def _touch(self, prop_ids: List[str]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE documents SET last_seen = ? WHERE index_name = ? AND prop_id = ?",
+                [(self.run_id, self.index_name, prop_id) for prop_id in prop_ids],
+            )
+            self._conn.commit()
+
+    def _lookup(self, record: dict) -> tuple:
+        """
+        (prop_id, path, size, mtime_ns, stored row, whether the file must be hashed).
+        """
+        prop_id = str(record["PropId"])
+        path = record.get("SystemPath") or None
+        size, mtime_ns = _stat(path)
+        stored = self._stored(prop_id)
+        # Same file, same size and mtime: the stored hash is trusted, the file not read
+        unchanged_file = stored is not None and stored[:3] == (path, size, mtime_ns)
+        needs_hash = not record.get("Hash") and size is not None and not unchanged_file
+        return prop_id, path, size, mtime_ns, stored, needs_hash
+
+    def _hash_ahead(self, records: Iterable[dict], pool: ThreadPoolExecutor,
+                    window: int) -> Iterator[Tuple[dict, Optional[tuple], Optional[Future]]]:
+        """
+        Yields (record, lookup or None for untracked records, hash future) in
+        input order, with up to `window` records' files being hashed ahead.
+        """
+        queued = deque()
+        for record in records:
+            lookup = self._lookup(record) if record.get("PropId") else None
+            future = pool.submit(_try_file_sha256, lookup[1]) if lookup is not None and lookup[5] else None
+            queued.append((record, lookup, future))
+            if len(queued) >= window:
+                yield queued.popleft()
+        while queued:
+            yield queued.popleft()
+
+    def _classify(self, record: dict, lookup: tuple, file_hash: Optional[str]) -> Optional[tuple]:
+        """
+        Returns the manifest row for a record that has to be sent, or None if
+        the indexed copy is up to date.
+        """
+        prop_id, path, size, mtime_ns, stored, needs_hash = lookup
+        record_hash = record_sha256(record)
+
+        content_hash = record.get("Hash") or None
+        if content_hash is None:
+            if needs_hash:
+                content_hash = file_hash
+            elif stored is not None and stored[:3] == (path, size, mtime_ns):
+                content_hash = stored[3]
+            if content_hash is not None:
+                record["Hash"] = content_hash
+
+        row = (prop_id, path, size, mtime_ns, content_hash, record_hash)
+        if stored is None:
+            self.stats.new += 1
+        elif self.full or stored[3] != content_hash or stored[4] != record_hash:
+            self.stats.changed += 1
+            if stored[3] != content_hash:
+                self.release_canonical(prop_id)
+        else:
+            self.stats.unchanged += 1
+            return None
+        return row
+
+    def changed_records(self, records: Iterable[dict], touch_batch: int = 1000,
+                        hash_workers: int = HASH_WORKERS) -> Iterator[dict]:
+        seen: List[str] = []
+        with ThreadPoolExecutor(max_workers=max(1, hash_workers), thread_name_prefix="hash") as pool:
+            for record, lookup, future in self._hash_ahead(records, pool, max(1, hash_workers) * 4):
+                if lookup is None:
+                    self.stats.untracked += 1
+                    yield record
+                    continue
+                # Marked as seen whether or not it is sent, so a document that
+                # fails to index is not mistaken for a removed one
+                seen.append(lookup[0])
+                if len(seen) >= touch_batch:
+                    self._touch(seen)
+                    seen = []
+                row = self._classify(record, lookup, future.result() if future is not None else None)
+                if row is None:
+                    continue
+                with self._lock:
+                    self._pending[row[0]] = row
+                yield record
+        if seen:
+            self._touch(seen)
+
+    def mark_indexed(self, prop_ids: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock:
+            rows = [self._pending.pop(str(prop_id), None) for prop_id in prop_ids]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (index_name, prop_id, system_path, size, mtime_ns, "
+                "content_hash, record_hash, indexed_at, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(self.index_name, *row, now, self.run_id) for row in rows if row is not None],
+            )
+            self._conn.commit()
+
+    def tracked_count(self) -> int:
+        """
+        Documents of this index the manifest knows to be indexed.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM documents WHERE index_name = ?", (self.index_name,)
+            ).fetchone()[0]
+
+    def removed_prop_ids(self) -> List[str]:
+        """
+        Documents indexed by an earlier run that this run's input no longer contains.
+        """
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT prop_id FROM documents WHERE index_name = ? AND last_seen != ?",
+                (self.index_name, self.run_id),
+            )]
+
+    def forget(self, prop_ids: Iterable[str]) -> None:
+        prop_ids = [str(prop_id) for prop_id in prop_ids]
+        for prop_id in prop_ids:
+            self.release_canonical(prop_id)
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM documents WHERE index_name = ? AND prop_id = ?",
+                [(self.index_name, prop_id) for prop_id in prop_ids],
+            )
+            self._conn.commit()
+
+    # --- Canonical text per content hash ---------------------------------
+    def canonical_for(self, content_hash: str, prop_id: str) -> str:
+        """
+        PropId of the document holding the text for `content_hash`; `prop_id`
+        becomes that document if there is none yet.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO contents (index_name, content_hash, canonical_prop_id) VALUES (?, ?, ?)",
+                (self.index_name, content_hash, prop_id),
+            )
+            return self._conn.execute(
+                "SELECT canonical_prop_id FROM contents WHERE index_name = ? AND content_hash = ?",
+                (self.index_name, content_hash),
+            ).fetchone()[0]
+
+    def release_canonical(self, prop_id: str) -> None:
+        """
+        `prop_id` no longer holds the text it was canonical for (its content
+        changed or it was deleted); the next record with that hash takes over.
+        """
+        with self._lock:
+            hashes = [row[0] for row in self._conn.execute(
+                "SELECT content_hash FROM contents WHERE index_name = ? AND canonical_prop_id = ?",
+                (self.index_name, prop_id),
+            )]
+            self._conn.execute(
+                "DELETE FROM contents WHERE index_name = ? AND canonical_prop_id = ?", (self.index_name, prop_id)
+            )
+            self._conn.commit()
+            self._released.update(hashes)
+
+    def requeue_released(self) -> Set[str]:
+        """
+        Marks the duplicates that still point at a released canonical document
+        as changed, so they are sent again against the current one (or one of
+        them becomes canonical). Returns their PropIds; duplicates already
+        sent during this run are left alone.
+        """
+        requeued: Set[str] = set()
+        with self._lock:
+            for content_hash in self._released:
+                row = self._conn.execute(
+                    "SELECT canonical_prop_id FROM contents WHERE index_name = ? AND content_hash = ?",
+                    (self.index_name, content_hash),
+                ).fetchone()
+                requeued.update(prop_id for (prop_id,) in self._conn.execute(
+                    "SELECT prop_id FROM documents WHERE index_name = ? AND content_hash = ? "
+                    "AND prop_id != ? AND indexed_at < ?",
+                    (self.index_name, content_hash, row[0] if row else "", self.started_at),
+                ))
+            # An empty record hash never matches, so changed_records sends them
+            self._conn.executemany(
+                "UPDATE documents SET record_hash = '' WHERE index_name = ? AND prop_id = ?",
+                [(self.index_name, prop_id) for prop_id in requeued],
+            )
+            self._conn.commit()
+            self._released.clear()
+        return requeued
@@ -0,0 +1,69 @@
+"""
+JSON encoding/decoding for search.py: orjson when it is installed, the
+standard library otherwise. Both produce compact UTF-8 output.
+
+Used for parsing Elasticsearch responses (`loads(response.content)` instead
+of `response.json()`), for API responses (FastJSONResponse) and for the
+NDJSON export.
+"""
+import json
+from typing import Any, Iterable, Iterator
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional; the stdlib fallback is slower on large pages
+    orjson = None
+
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+if orjson is not None:
+    # Non-string keys are stringified like the json module does
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS)
+
+    def dumps_line(obj: Any) -> bytes:
+        return orjson.dumps(obj, option=_ORJSON_OPTIONS | orjson.OPT_APPEND_NEWLINE)
+
+    loads = orjson.loads
+
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode("utf-8")
+
+    def dumps_line(obj: Any) -> bytes:
+        return (_encoder.encode(obj) + "\n").encode("utf-8")
+
+    def loads(data):
+        return json.loads(data)
+
+
+def iter_ndjson_chunks(objs: Iterable[Any], chunk_bytes: int) -> Iterator[bytes]:
+    """
+    Encodes objs as NDJSON lines grouped into chunks of about chunk_bytes
+    (a single larger line is its own chunk).
+    """
+    lines = []
+    size = 0
+    for obj in objs:
+        line = dumps_line(obj)
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield b"".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield b"".join(lines)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
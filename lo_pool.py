@@ -0,0 +1,284 @@
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+try:
+    import uno  # ships with LibreOffice (python3-uno)
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+except ImportError:
+    uno = None
+
+
+logger = logging.getLogger(__name__)
+
+
+LO_POOL_SIZE = int(os.getenv("LO_POOL_SIZE", "2"))
+LO_POOL_MAX_JOBS = int(os.getenv("LO_POOL_MAX_JOBS", "50"))  # recycle an instance after this many conversions
+LO_POOL_STARTUP_TIMEOUT = float(os.getenv("LO_POOL_STARTUP_TIMEOUT", "30"))
+LO_POOL_ACQUIRE_TIMEOUT = float(os.getenv("LO_POOL_ACQUIRE_TIMEOUT", "60"))
+
+# storeToURL filter names (the CLI accepts looser names than the UNO API)
+HTML_EXPORT_FILTER = "HTML (StarWriter)"
+IMPRESS_PDF_EXPORT_FILTER = "impress_pdf_Export"
+
+
+class LibreOfficePoolError(RuntimeError):
+    pass
+
+
+class LibreOfficeUnavailable(LibreOfficePoolError):
+    """No usable instance (pool closed, or instances could not be restarted); callers fall back to the CLI."""
+
+
+def uno_available() -> bool:
+    return uno is not None
+
+
+def _props(**kwargs) -> tuple:
+    result = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        result.append(prop)
+    return tuple(result)
+
+
+class LibreOfficeInstance:
+    """
+    One headless soffice process with its own user profile, driven over a
+    named UNO pipe. Pipe names include the worker's pid, so several uvicorn
+    workers each get their own instances instead of sharing fixed ports.
+    """
+
+    def __init__(self, binary: str, name: str):
+        self.binary = binary
+        self.name = name
+        self.profile_dir: Optional[Path] = None
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.jobs_done = 0
+
+    def start(self) -> None:
+        self.profile_dir = Path(tempfile.mkdtemp(prefix=f"{self.name}_profile_"))
+        cmd = [
+            self.binary, "--headless", "--invisible", "--nologo", "--nodefault",
+            "--norestore", "--nolockcheck", "--nofirststartwizard",
+            f"-env:UserInstallation={self.profile_dir.as_uri()}",
+            f"--accept=pipe,name={self.name};urp;StarOffice.ComponentContext",
+        ]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        ctx = self._connect()
+        self._check_profile(ctx)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+        self.jobs_done = 0
+        logger.info(f"LibreOffice instance {self.name} started (pid {self.process.pid})")
+
+    def _connect(self):
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_ctx
+        )
+        url = f"uno:pipe,name={self.name};urp;StarOffice.ComponentContext"
+        deadline = time.monotonic() + LO_POOL_STARTUP_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise LibreOfficePoolError(f"soffice {self.name} exited during startup (code {self.process.returncode})")
+            try:
+                return resolver.resolve(url)
+            except NoConnectException:
+                if time.monotonic() > deadline:
+                    raise LibreOfficePoolError(f"Timed out connecting to soffice {self.name}")
+                time.sleep(0.25)
+
+    def _check_profile(self, ctx) -> None:
+        # The pipe could still belong to a leftover process (e.g. one that did
+        # not exit after kill); only the soffice we spawned uses our profile.
+        settings = ctx.ServiceManager.createInstanceWithContext("com.sun.star.util.PathSettings", ctx)
+        user_config = settings.UserConfig
+        if not user_config.startswith(self.profile_dir.as_uri()):
+            raise LibreOfficePoolError(
+                f"soffice answering on pipe {self.name} is not the one started for it (profile {user_config})"
+            )
+
+    def is_healthy(self) -> bool:
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()  # cheap round trip over the bridge
+            return True
+        except Exception:
+            return False
+
+    def kill(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+    def stop(self) -> None:
+        if self.desktop is not None and self.process is not None and self.process.poll() is None:
+            try:
+                self.desktop.terminate()
+                self.process.wait(timeout=5)
+            except Exception:
+                pass
+        self.kill()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                logger.warning(f"soffice pid {self.process.pid} did not exit after kill")
+        self.desktop = None
+        self.process = None
+        if self.profile_dir is not None:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+    def convert(self, source_file: Path, output_file: Path, filter_name: str, timeout: float) -> None:
+        # A hung conversion cannot be interrupted over UNO, so the watchdog kills
+        # the process; the pending call then fails and the instance gets recycled.
+        watchdog = threading.Timer(timeout, self.kill)
+        watchdog.daemon = True
+        watchdog.start()
+        document = None
+        try:
+            document = self.desktop.loadComponentFromURL(
+                source_file.resolve().as_uri(), "_blank", 0, _props(Hidden=True, ReadOnly=True)
+            )
+            if document is None:
+                raise LibreOfficePoolError(f"LibreOffice could not open {source_file.name}")
+            document.storeToURL(output_file.resolve().as_uri(), _props(FilterName=filter_name))
+        except LibreOfficePoolError:
+            raise
+        except Exception as e:
+            if not watchdog.is_alive():
+                raise LibreOfficePoolError(f"LibreOffice conversion timed out after {timeout}s for {source_file.name}") from e
+            raise LibreOfficePoolError(f"LibreOffice conversion failed for {source_file.name}: {e}") from e
+        finally:
+            watchdog.cancel()
+            if document is not None:
+                try:
+                    document.close(True)
+                except Exception:
+                    pass
+            self.jobs_done += 1
+
+
+class LibreOfficePool:
+    """
+    A fixed number of warm LibreOffice instances. Each conversion borrows one
+    instance; instances are health-checked on checkout and replaced after
+    `max_jobs` conversions or when they crash.
+    """
+
+    def __init__(self, binary: str, size: int = LO_POOL_SIZE, max_jobs: int = LO_POOL_MAX_JOBS):
+        if not uno_available():
+            raise LibreOfficePoolError("The 'uno' module is not available; install python3-uno to use the pool")
+        self.binary = binary
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle: "queue.Queue[LibreOfficeInstance]" = queue.Queue()
+        self._all: List[LibreOfficeInstance] = []  # live instances; dead slots are dropped
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self) -> None:
+        for i in range(self.size):
+            instance = LibreOfficeInstance(self.binary, f"lo_{os.getpid()}_{i}")
+            try:
+                instance.start()
+            except Exception:
+                instance.stop()
+                raise
+            with self._lock:
+                self._all.append(instance)
+            self._idle.put(instance)
+
+    def close(self) -> None:
+        self._closed = True
+        with self._lock:
+            instances = list(self._all)
+            self._all.clear()
+        for instance in instances:
+            instance.stop()
+
+    @property
+    def live(self) -> int:
+        with self._lock:
+            return len(self._all)
+
+    def _recycle(self, instance: LibreOfficeInstance, reason: str) -> bool:
+        """
+        Restarts an instance. If it does not come back, its slot is dropped
+        (returns False) rather than retried by every later conversion.
+        """
+        logger.info(f"Recycling LibreOffice instance {instance.name}: {reason}")
+        instance.stop()
+        try:
+            instance.start()
+            return True
+        except Exception as e:
+            logger.error(f"Could not restart LibreOffice instance {instance.name}, "
+                         f"dropping it from the pool: {e}")
+            instance.stop()
+            with self._lock:
+                if instance in self._all:
+                    self._all.remove(instance)
+            return False
+
+    def _acquire(self) -> LibreOfficeInstance:
+        # Polls so that waiters notice at once when the last instance is dropped
+        deadline = time.monotonic() + LO_POOL_ACQUIRE_TIMEOUT
+        while True:
+            if self._closed:
+                raise LibreOfficeUnavailable("LibreOffice pool is closed")
+            if not self.live:
+                raise LibreOfficeUnavailable("No LibreOffice instance in the pool is running")
+            try:
+                return self._idle.get(timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    raise LibreOfficePoolError("No LibreOffice instance became free in time")
+
+    @contextmanager
+    def _checkout(self) -> Iterator[LibreOfficeInstance]:
+        instance = self._acquire()
+        usable = True
+        try:
+            if instance.jobs_done >= self.max_jobs:
+                usable = self._recycle(instance, f"served {instance.jobs_done} jobs")
+            elif not instance.is_healthy():
+                usable = self._recycle(instance, "failed health check")
+            if not usable:
+                raise LibreOfficeUnavailable(f"LibreOffice instance {instance.name} could not be restarted")
+            yield instance
+            if not instance.is_healthy():
+                usable = self._recycle(instance, "unhealthy after job")
+        except Exception:
+            if usable and not instance.is_healthy():
+                usable = self._recycle(instance, "crashed during job")
+            raise
+        finally:
+            if usable:
+                self._idle.put(instance)
+
+    def convert(self, source_file: Path, output_dir: Path, filter_name: str, extension: str,
+                timeout: float = 120) -> Path:
+        """
+        Converts `source_file` into `output_dir` and returns the output path.
+        Blocks until an instance is free.
+        """
+        output_file = output_dir / (source_file.stem + extension)
+        with self._checkout() as instance:
+            instance.convert(source_file, output_file, filter_name, timeout)
+        if not output_file.is_file():
+            raise LibreOfficePoolError(f"LibreOffice produced no output for {source_file.name}")
+        return output_file
@@ -0,0 +1,213 @@
+"""
+Logging for the API processes: handlers run on a background thread, records
+are JSON lines tagged with the request they belong to.
+
+Handlers attached to the root logger by `configure_logging` only put the
+record on a queue; a QueueListener thread formats it and does the file and
+console writes, so request handlers never wait on disk or stderr. Messages
+are not formatted on the caller's side either: pass values as logging
+arguments or as `extra={"fields": {...}}` rather than pre-formatting them,
+and don't mutate objects handed to a log call afterwards.
+
+Debug records are sampled per request (LOG_DEBUG_SAMPLE_RATE), so a sampled
+request keeps all of its debug lines and the rest keep none.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.getenv("LOG_FILE", "logs/app.log")  # empty -> console only
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+# Share of requests whose DEBUG records are kept (when LOG_LEVEL=DEBUG)
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.01"))
+# Records beyond this many waiting for the writer thread are dropped, not waited for
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+REQUEST_ID_HEADER = "x-request-id"
+_VALID_REQUEST_ID = re.compile(r"[A-Za-z0-9._:-]{1,128}")
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+# None outside a request: each debug record is sampled on its own
+debug_sampled_var: ContextVar[Optional[bool]] = ContextVar("debug_sampled", default=None)
+
+# One INFO line per outgoing HTTP call; kept at WARNING unless LOG_LEVEL=DEBUG
+CHATTY_LOGGERS = ("httpx", "httpcore")
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(name)s - [%(request_id)s] %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """The old console format, with the request ID and any structured fields appended."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.request_id = getattr(record, "request_id", None) or "-"
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        if fields:
+            line = f"{line} {json.dumps(fields, default=str, ensure_ascii=False)}"
+        return line
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Runs on the caller's side of the queue, where the request's context is
+    still current: stamps the request ID and drops debug records of requests
+    that were not sampled.
+    """
+
+    def __init__(self, debug_sample_rate: float):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if record.levelno <= logging.DEBUG:
+            sampled = debug_sampled_var.get()
+            if sampled is None:
+                sampled = random.random() < self.debug_sample_rate
+            return sampled
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener thread (the stock one
+    formats the message on the caller's side) and drops records when the
+    queue is full instead of blocking or printing a traceback per record.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(
+    level: str = LOG_LEVEL,
+    log_file: Optional[str] = LOG_FILE,
+    log_format: str = LOG_FORMAT,
+    debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE,
+) -> logging.handlers.QueueListener:
+    """
+    Replaces the root logger's handlers with a queue handler and starts the
+    writer thread (stopped, and the queue flushed, at interpreter exit).
+    Calling it again returns the running listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = JsonFormatter() if log_format == "json" else TextFormatter()
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter(debug_sample_rate))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    if root.getEffectiveLevel() > logging.DEBUG:
+        for name in CHATTY_LOGGERS:
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware giving each HTTP request an ID (the caller's X-Request-ID
+    when it sends a usable one), echoed back in the response headers and
+    attached to every log record written while handling it. Also decides
+    whether the request's debug records are kept.
+    """
+
+    def __init__(self, app, debug_sample_rate: float = LOG_DEBUG_SAMPLE_RATE):
+        self.app = app
+        self.debug_sample_rate = debug_sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == REQUEST_ID_HEADER.encode("latin-1"):
+                candidate = value.decode("latin-1")
+                if _VALID_REQUEST_ID.fullmatch(candidate):
+                    request_id = candidate
+                break
+        if request_id is None:
+            request_id = uuid.uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER.encode("latin-1"), request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        id_token = request_id_var.set(request_id)
+        sampled_token = debug_sampled_var.set(random.random() < self.debug_sample_rate)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(id_token)
+            debug_sampled_var.reset(sampled_token)
@@ -6,23 +6,117 @@
 
 # Add these imports at the top of your Python file
 import base64
-from bs4 import BeautifulSoup # pip install beautifulsoup4
+import hashlib
+import re
 from urllib.parse import unquote # To handle URL-encoded filenames if any
 import os
 import shutil # For shutil.which to find libreoffice
 import mimetypes
 import subprocess
 import tempfile
+import time
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterable, Iterator, List, Literal, Optional
 
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, Query, HTTPException, Request
+from contextlib import asynccontextmanager
+from fastapi.responses import FileResponse, HTMLResponse, Response
+from starlette.concurrency import run_in_threadpool
+
+from conversion_queue import ConversionLimiter
+from http_ranges import etag_matches, ranged_file_response
+from html_rewriter import iter_text_chunks, rewrite_img_sources
+from preview_cache import PreviewCache, PREVIEW_CACHE_DIR, PREVIEW_CACHE_MAX_BYTES, PREVIEW_CACHE_KEY_MODE
+from lo_pool import (
+    LibreOfficePool, LibreOfficePoolError, LibreOfficeUnavailable, uno_available,
+    LO_POOL_SIZE, HTML_EXPORT_FILTER, IMPRESS_PDF_EXPORT_FILTER,
+)
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, CONVERSION_STAGE_SECONDS, EMBED_IMAGE_STAGE_SECONDS,
+    PREVIEW_STAGE_SECONDS, register_cache, register_gauge, render_metrics,
+)
 
 # ... (your existing imports: os, shutil, mimetypes, subprocess, tempfile, Path, etc.)
 # ... (FastAPI imports, Settings, logger, etc.)
 
 
+# Converted previews are cached on disk, keyed by the identity of the source file
+PREVIEW_HTML_NAME = "preview.html"
+PREVIEW_PDF_NAME = "preview.pdf"
+PREVIEW_ASSETS_DIR_NAME = "assets"
+# "inline" embeds preview images as Base64, "assets" serves them from /api/previews/{id}/assets/{name}
+PREVIEW_IMAGE_MODES = ("inline", "assets")
+PREVIEW_IMAGE_MODE = os.getenv("PREVIEW_IMAGE_MODE", "inline")
+if PREVIEW_IMAGE_MODE not in PREVIEW_IMAGE_MODES:
+    logger.warning(f"Unknown PREVIEW_IMAGE_MODE {PREVIEW_IMAGE_MODE!r}, using 'inline'")
+    PREVIEW_IMAGE_MODE = "inline"
+PREVIEW_ID_RE = re.compile(r"[0-9a-f]{64}")
+ASSET_NAME_RE = re.compile(r"[0-9a-f]{32}\.[a-z0-9]{1,5}")
+ASSET_SUFFIX_RE = re.compile(r"\.[a-z0-9]{1,5}")
+preview_cache = PreviewCache(Path(PREVIEW_CACHE_DIR), PREVIEW_CACHE_MAX_BYTES, key_mode=PREVIEW_CACHE_KEY_MODE)
+
+# Bounded thread pool + wait queue for LibreOffice work (503 + Retry-After when full)
+conversion_limiter = ConversionLimiter()
+
+# Warm LibreOffice instances, started with the app (None -> one soffice process per conversion)
+lo_pool: Optional[LibreOfficePool] = None
+
+register_cache("preview", preview_cache)
+register_gauge("preview_cache_bytes", "Size of the on-disk preview cache.", lambda: preview_cache.total_bytes)
+register_gauge("conversions_in_flight", "LibreOffice conversions running now.", lambda: conversion_limiter.running)
+register_gauge("conversions_waiting", "Conversion requests waiting for a free slot.", lambda: conversion_limiter.waiting)
+
+
+def start_libreoffice_pool():
+    global lo_pool
+    if not LIBREOFFICE_PATH or LO_POOL_SIZE <= 0:
+        return
+    if not uno_available():
+        logger.warning("python3-uno is not installed; LibreOffice conversions will start a new soffice process each time.")
+        return
+    pool = LibreOfficePool(LIBREOFFICE_PATH)
+    try:
+        pool.start()
+    except LibreOfficePoolError as e:
+        logger.error(f"Could not start LibreOffice pool, falling back to one soffice process per conversion: {e}")
+        pool.close()
+        return
+    lo_pool = pool
+    logger.info(f"LibreOffice pool started with {LO_POOL_SIZE} instances")
+
+
+def stop_libreoffice_pool():
+    global lo_pool
+    conversion_limiter.shutdown()
+    if lo_pool is not None:
+        lo_pool.close()
+        lo_pool = None
+
+
+@asynccontextmanager
+async def libreoffice_lifespan(app: FastAPI):
+    await run_in_threadpool(start_libreoffice_pool)
+    try:
+        yield
+    finally:
+        await run_in_threadpool(stop_libreoffice_pool)
+
+
+# The host app owns the lifespan (on_event handlers are ignored once it has one),
+# so the pool's start/stop is nested inside whatever lifespan it already runs
+_host_lifespan = app.router.lifespan_context
+
+
+@asynccontextmanager
+async def _preview_lifespan(app: FastAPI):
+    async with _host_lifespan(app) as state:
+        async with libreoffice_lifespan(app):
+            yield state
+
+
+app.router.lifespan_context = _preview_lifespan
+
+
 
 # --- Helper Functions ---
 def is_path_secure_and_valid(client_path_str: str, allowed_roots: List[Path]) -> Optional[Path]:
@@ -43,7 +137,7 @@ def is_path_secure_and_valid(client_path_str: str, allowed_roots: List[Path]) ->
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"File not found at: {client_path_str}")
     except Exception as e: # Catch other resolution errors (e.g., permission issues during resolve)
-        print(f"Error resolving path '{client_path_str}': {e}")
+        logger.error(f"Error resolving path '{client_path_str}': {e}")
         raise HTTPException(status_code=500, detail="Error processing file path.")
 
     if not resolved_path.is_file():
@@ -61,87 +155,150 @@ def is_path_secure_and_valid(client_path_str: str, allowed_roots: List[Path]) ->
             continue
     
     if not is_allowed:
-        print(f"SECURITY ALERT: Unauthorized access attempt to '{resolved_path}' (original: '{client_path_str}')")
+        logger.warning(f"SECURITY ALERT: Unauthorized access attempt to '{resolved_path}' (original: '{client_path_str}')")
         raise HTTPException(status_code=403, detail="Access to this file path is forbidden.")
 
     return resolved_path
 
-def embed_images_as_base64(html_content: str, base_path: Path) -> str:
+def resolve_local_image(src: Optional[str], base_path: Path) -> Optional[Path]:
+    """
+    Resolves a relative <img src> against base_path.
+    Returns None for remote/data URIs, path traversal attempts and missing files.
+    """
+    if not src or src.startswith(('http:', 'https:', 'data:')):
+        return None
+
+    # It's a relative path, resolve it against the HTML file's location
+    # LibreOffice might create subdirectories for images, e.g., "_html_images"
+    # or put them in the same directory.
+
+    # Handle URL-encoded filenames from LibreOffice (e.g., %20 for space)
+    image_relative_path_decoded = unquote(src)
+    image_path = (base_path / image_relative_path_decoded).resolve()
+
+    # Security check: ensure image_path is still within base_path
+    # This is important if `src` could somehow contain `../` etc.
+    if not str(image_path).startswith(str(base_path.resolve())):
+        logger.warning(f"Skipping image due to potential path traversal: {src} from base {base_path}")
+        return None
+
+    if not image_path.is_file():
+        logger.warning(f"Image not found for embedding: {image_path} (original src: {src})")
+        return None
+    return image_path
+
+
+def embed_images_as_base64(html_chunks: Iterable[str], base_path: Path) -> Iterator[str]:
     """
-    Parses HTML content, finds local image references, and embeds them as Base64.
+    Streams HTML through, embedding local image references as Base64.
     Args:
-        html_content: The HTML string.
+        html_chunks: The HTML, as an iterable of text chunks.
         base_path: The directory where the HTML file and its associated images are located.
-    Returns:
-        HTML string with images embedded as Base64.
+    Yields:
+        HTML chunks with images embedded as Base64.
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
     images_embedded_count = 0
-    for img_tag in soup.find_all('img'):
-        src = img_tag.get('src')
-        if src and not src.startswith(('http:', 'https:', 'data:')):
-            # It's a relative path, resolve it against the HTML file's location
-            # LibreOffice might create subdirectories for images, e.g., "_html_images"
-            # or put them in the same directory.
-            
-            # Handle URL-encoded filenames from LibreOffice (e.g., %20 for space)
-            image_relative_path_decoded = unquote(src)
-            image_path = (base_path / image_relative_path_decoded).resolve()
 
-            # Security check: ensure image_path is still within base_path
-            # This is important if `src` could somehow contain `../` etc.
-            if not str(image_path).startswith(str(base_path.resolve())):
-                logger.warning(f"Skipping image due to potential path traversal: {src} from base {base_path}")
-                continue
+    def to_data_uri(src: str) -> Optional[str]:
+        nonlocal images_embedded_count
+        with EMBED_IMAGE_STAGE_SECONDS.time("resolve"):
+            image_path = resolve_local_image(src, base_path)
+        if image_path is None:
+            return None
+        try:
+            with EMBED_IMAGE_STAGE_SECONDS.time("read"), open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+            with EMBED_IMAGE_STAGE_SECONDS.time("encode"):
+                encoded_string = base64.b64encode(image_bytes).decode('utf-8')
+
+            # Guess MIME type for the data URI
+            mime_type, _ = mimetypes.guess_type(image_path)
+            mime_type = mime_type or 'image/png' # Default if guess fails
+
+            images_embedded_count += 1
+            return f"data:{mime_type};base64,{encoded_string}"
+        except Exception as e:
+            logger.error(f"Error embedding image {image_path}: {e}")
+            return None
+
+    yield from rewrite_img_sources(html_chunks, to_data_uri)
 
-            if image_path.is_file():
-                try:
-                    with open(image_path, "rb") as image_file:
-                        encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
-                    
-                    # Guess MIME type for the data URI
-                    mime_type, _ = mimetypes.guess_type(image_path)
-                    mime_type = mime_type or 'image/png' # Default if guess fails
-
-                    img_tag['src'] = f"data:{mime_type};base64,{encoded_string}"
-                    images_embedded_count += 1
-                    # logger.debug(f"Embedded image: {image_path}")
-                except Exception as e:
-                    logger.error(f"Error embedding image {image_path}: {e}")
-            else:
-                logger.warning(f"Image not found for embedding: {image_path} (original src: {src})")
-    
     if images_embedded_count > 0:
         logger.info(f"Successfully embedded {images_embedded_count} images as Base64.")
-    return str(soup)
 
 
-# *** UPDATED *** convert_to_html_with_libreoffice
-def convert_to_html_with_libreoffice(source_file: Path, output_dir: Path, embed_images: bool = True) -> str: # Returns HTML string
+def store_image_asset(image_path: Path, asset_dir: Path) -> str:
     """
-    Converts a document to HTML using LibreOffice.
-    Optionally embeds images as Base64.
-    Raises exceptions on failure. Returns the HTML content as a string.
+    Copies an image into asset_dir under a content-derived name and returns that name.
+    Identical images within a document share one asset.
     """
-    if not LIBREOFFICE_PATH:
-        raise RuntimeError("LibreOffice binary path is not configured or found.")
-    if not source_file.exists():
-        raise FileNotFoundError(f"Source file for conversion does not exist: {source_file}")
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    suffix = image_path.suffix.lower() if ASSET_SUFFIX_RE.fullmatch(image_path.suffix.lower()) else ".bin"
+    asset_name = digest.hexdigest()[:32] + suffix
+    asset_path = asset_dir / asset_name
+    if not asset_path.exists():
+        shutil.copyfile(image_path, asset_path)
+    return asset_name
+
+
+def link_images_as_assets(html_chunks: Iterable[str], base_path: Path, asset_dir: Path, url_prefix: str) -> Iterator[str]:
+    """
+    Like embed_images_as_base64, but copies local images into asset_dir and points
+    each <img src> at url_prefix/<asset name>, so the browser can fetch and cache
+    them separately.
+    """
+    asset_dir.mkdir(parents=True, exist_ok=True)
+    images_linked_count = 0
+
+    def to_asset_url(src: str) -> Optional[str]:
+        nonlocal images_linked_count
+        image_path = resolve_local_image(src, base_path)
+        if image_path is None:
+            return None
+        try:
+            asset_url = f"{url_prefix}/{store_image_asset(image_path, asset_dir)}"
+            images_linked_count += 1
+            return asset_url
+        except Exception as e:
+            logger.error(f"Error storing image asset {image_path}: {e}")
+            return None
+
+    yield from rewrite_img_sources(html_chunks, to_asset_url)
+
+    if images_linked_count > 0:
+        logger.info(f"Stored {images_linked_count} images as preview assets.")
+
+
+def run_libreoffice_conversion(source_file: Path, output_dir: Path, cli_convert_to: str,
+                               pool_filter: str, extension: str, timeout: int) -> None:
+    """
+    Converts source_file into output_dir. Uses a warm instance from the LibreOffice
+    pool when it is running, otherwise (or when the pool has no instance left
+    that starts) a one-off soffice process.
+    Raises RuntimeError on failure.
+    """
+    if lo_pool is not None:
+        try:
+            lo_pool.convert(source_file, output_dir, pool_filter, extension, timeout=timeout)
+            return
+        except LibreOfficeUnavailable as e:
+            logger.warning(f"{e}; converting {source_file.name} with a one-off soffice process")
+        except LibreOfficePoolError as e:
+            logger.error(str(e))
+            raise RuntimeError(str(e)) from e
 
-    # LibreOffice will create files in output_dir.
-    # We expect an HTML file and potentially image files/subdirectories.
-    
     cmd = [
         LIBREOFFICE_PATH, "--headless", "--nolockcheck", "--nodefault",
         "--norestore", "--invisible",
-        "--convert-to", "html:HTML (StarWriter)", # This filter usually handles images better
-        # Forcing a specific HTML export filter might be needed if images are problematic
-        # e.g. "html:XHTML Writer File" might behave differently with images
+        "--convert-to", cli_convert_to,
         "--outdir", str(output_dir), str(source_file)
     ]
 
     try:
-        process = subprocess.run(cmd, check=True, timeout=120, capture_output=True, text=True, errors='replace')
+        process = subprocess.run(cmd, check=True, timeout=timeout, capture_output=True, text=True, errors='replace')
         if process.stderr:
              logger.info(f"LibreOffice STDERR for {source_file.name} conversion: {process.stderr[:1000]}") # Log stderr
     except subprocess.TimeoutExpired as e:
@@ -158,6 +315,29 @@ def convert_to_html_with_libreoffice(source_file: Path, output_dir: Path, embed_
         logger.error(error_msg)
         raise RuntimeError(error_msg) from e
 
+
+# *** UPDATED *** convert_to_html_with_libreoffice
+def convert_to_html_with_libreoffice(source_file: Path, output_dir: Path) -> Path: # Returns the HTML file path
+    """
+    Converts a document to HTML using LibreOffice.
+    Images are left as separate files next to the HTML; see write_html_preview.
+    Raises exceptions on failure. Returns the path of the generated HTML file.
+    """
+    if not LIBREOFFICE_PATH:
+        raise RuntimeError("LibreOffice binary path is not configured or found.")
+    if not source_file.exists():
+        raise FileNotFoundError(f"Source file for conversion does not exist: {source_file}")
+
+    # LibreOffice will create files in output_dir.
+    # We expect an HTML file and potentially image files/subdirectories.
+    with CONVERSION_STAGE_SECONDS.time("html", "libreoffice"):
+        run_libreoffice_conversion(
+            source_file, output_dir,
+            cli_convert_to="html:HTML (StarWriter)", # This filter usually handles images better
+            pool_filter=HTML_EXPORT_FILTER, extension=".html", timeout=120
+        )
+    locate_started = time.perf_counter()
+
     # Find the generated HTML file. LibreOffice typically names it based on the source stem.
     # It might also create subfolders like 'filename_html_SOMEHASH' or just 'filename.html'
     
@@ -183,24 +363,133 @@ def convert_to_html_with_libreoffice(source_file: Path, output_dir: Path, embed_
         html_file_path = html_files_in_output[0] # Take the first one found
         logger.warning(f"Expected HTML file '{expected_html_filename}' not found. Using first found: '{html_file_path.name}'")
 
+    CONVERSION_STAGE_SECONDS.observe(time.perf_counter() - locate_started, "html", "locate_output")
     logger.info(f"LibreOffice successfully converted '{source_file.name}' to '{html_file_path}'.")
-    
-    with open(html_file_path, "r", encoding="utf-8", errors="replace") as f:
-        html_content = f.read()
+    return html_file_path
+
 
-    if embed_images:
+def write_html_preview(html_file_path: Path, out_path: Path, image_mode: str = "inline",
+                       asset_dir: Optional[Path] = None, asset_url_prefix: str = "") -> None:
+    """
+    Streams LibreOffice's HTML output into out_path, rewriting <img> tags on the way:
+    Base64 data URIs for image_mode "inline", asset URLs for "assets".
+    The document is never held in memory as a whole.
+    """
+    html_chunks = iter_text_chunks(html_file_path)
+    # The base path for resolving relative image URLs is the directory containing the HTML file.
+    if image_mode == "assets":
+        rewritten = link_images_as_assets(html_chunks, html_file_path.parent, asset_dir, asset_url_prefix)
+    else:
         logger.info(f"Attempting to embed images for {html_file_path.name} from base directory {html_file_path.parent}")
-        # The base path for resolving relative image URLs is the directory containing the HTML file.
-        html_content_with_embedded_images = embed_images_as_base64(html_content, html_file_path.parent)
-        return html_content_with_embedded_images
-    
-    return html_content
+        rewritten = embed_images_as_base64(html_chunks, html_file_path.parent)
+
+    with open(out_path, "w", encoding="utf-8") as out:
+        for piece in rewritten:
+            out.write(piece)
+
+
+def build_html_preview(source_file: Path, cache_key: str, image_mode: str = "inline") -> Path:
+    """
+    Converts a DOC/DOCX to HTML and publishes it to the preview cache.
+    image_mode "inline" embeds images as Base64; "assets" stores them next to the
+    cached HTML, served by /api/previews/{cache_key}/assets/{name}.
+    Blocking; meant to run on the conversion thread pool. Returns the cached HTML path.
+    """
+    with tempfile.TemporaryDirectory(prefix="lo_html_convert_") as tmp_dir_str, \
+            preview_cache.staging() as staging_dir:
+        with PREVIEW_STAGE_SECONDS.time("html", "convert"):
+            html_file_path = convert_to_html_with_libreoffice(source_file, Path(tmp_dir_str))
+        # Image rewriting (embedding or asset copies) and the disk write happen together while streaming
+        with PREVIEW_STAGE_SECONDS.time("html", "write_html"):
+            write_html_preview(
+                html_file_path, staging_dir / PREVIEW_HTML_NAME, image_mode,
+                asset_dir=staging_dir / PREVIEW_ASSETS_DIR_NAME,
+                asset_url_prefix=f"/api/previews/{cache_key}/assets",
+            )
+        with PREVIEW_STAGE_SECONDS.time("html", "publish"):
+            entry_dir = preview_cache.publish(cache_key, staging_dir)
+    return entry_dir / PREVIEW_HTML_NAME
+
+
+def build_pdf_preview(source_file: Path, cache_key: str) -> Path:
+    """
+    Converts a PPT/PPTX to PDF and publishes it to the preview cache.
+    Blocking; meant to run on the conversion thread pool. Returns the cached PDF path.
+    """
+    with tempfile.TemporaryDirectory(prefix="lo_pdf_convert_") as tmp_dir_str, \
+            preview_cache.staging() as staging_dir:
+        tmp_output_dir = Path(tmp_dir_str)
+        convert_started = time.perf_counter()
+        with CONVERSION_STAGE_SECONDS.time("pdf", "libreoffice"):
+            run_libreoffice_conversion(
+                source_file, tmp_output_dir,
+                cli_convert_to="pdf:writer_pdf_Export", # Specific PDF export filter
+                pool_filter=IMPRESS_PDF_EXPORT_FILTER, extension=".pdf", timeout=180
+            )
+        locate_started = time.perf_counter()
+
+        pdf_filename = source_file.stem + ".pdf"
+        converted_pdf_path = tmp_output_dir / pdf_filename
+
+        if not converted_pdf_path.is_file():
+            # Fallback: search for any .pdf file
+            pdf_files = list(tmp_output_dir.glob("*.pdf"))
+            if not pdf_files:
+                raise FileNotFoundError("LibreOffice PDF conversion failed: No PDF file found.")
+            converted_pdf_path = pdf_files[0]
+            logger.warning(f"Expected PDF file '{pdf_filename}' not found. Using first found: '{converted_pdf_path.name}'")
+
+        CONVERSION_STAGE_SECONDS.observe(time.perf_counter() - locate_started, "pdf", "locate_output")
+        PREVIEW_STAGE_SECONDS.observe(time.perf_counter() - convert_started, "pdf", "convert")
+        logger.info(f"Successfully converted '{source_file.name}' to PDF: '{converted_pdf_path}'")
+        with PREVIEW_STAGE_SECONDS.time("pdf", "publish"):
+            shutil.move(str(converted_pdf_path), staging_dir / PREVIEW_PDF_NAME)
+            entry_dir = preview_cache.publish(cache_key, staging_dir)
+    return entry_dir / PREVIEW_PDF_NAME
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus scrape endpoint: conversion and image embedding stage
+    histograms, in-flight conversions and preview cache hit ratio.
+    """
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get("/api/previews/{preview_id}/assets/{asset_name}")
+async def get_preview_asset(preview_id: str, asset_name: str, request: Request):
+    """
+    Serves an image extracted from a cached HTML preview. Asset names are content
+    hashes, so responses never change and can be cached forever.
+    """
+    if not PREVIEW_ID_RE.fullmatch(preview_id) or not ASSET_NAME_RE.fullmatch(asset_name):
+        raise HTTPException(status_code=404, detail="Preview asset not found.")
+
+    # Located on disk rather than through get(): the preview may have been built by
+    # another worker, and asset fetches are not preview lookups for the hit ratio
+    entry_dir = preview_cache.locate(preview_id)
+    asset_path = entry_dir / PREVIEW_ASSETS_DIR_NAME / asset_name if entry_dir is not None else None
+    if asset_path is None or not asset_path.is_file():
+        raise HTTPException(status_code=404, detail="Preview asset not found.")
+
+    etag = f'"{Path(asset_name).stem}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    mime_type, _ = mimetypes.guess_type(asset_name)
+    return FileResponse(path=asset_path, media_type=mime_type or "application/octet-stream", headers=headers)
+
 
 # *** UPDATED *** /api/documents/{file_path:path} endpoint
 @app.get("/api/documents/{file_path:path}")
 async def get_document(
     file_path: str,
-    action: str = Query("view", enum=["view", "download"]),
+    request: Request,
+    action: Literal["view", "download"] = Query("view"),
+    # Validated (422 otherwise): the mode is part of the cache key
+    images: Literal["inline", "assets"] = Query(PREVIEW_IMAGE_MODE),
 ):
     try:
         valid_src_path: Path = is_path_secure_and_valid(file_path, ALLOWED_DOCUMENT_ROOTS) # Your validation function
@@ -224,83 +513,73 @@ async def get_document(
         elif action == "view":
             # --- DOC/DOCX to HTML (with embedded images) ---
             if file_extension in [".doc", ".docx"] and LIBREOFFICE_PATH:
-                with tempfile.TemporaryDirectory(prefix="lo_html_convert_") as tmp_dir_str:
-                    tmp_output_dir = Path(tmp_dir_str)
-                    try:
-                        # Call the updated function that returns HTML string
-                        html_content_with_embedded_images = convert_to_html_with_libreoffice(
-                            valid_src_path, 
-                            tmp_output_dir,
-                            embed_images=True # Ensure this is true
-                        )
-                        return HTMLResponse(content=html_content_with_embedded_images)
-                    except (RuntimeError, FileNotFoundError) as conversion_error:
-                        logger.error(f"HTML conversion failed for {valid_src_path.name}: {conversion_error}")
-                        return HTMLResponse(
-                            content=f"<html><body><h1>Preview Unavailable</h1><p>Could not generate a preview for {valid_src_path.name}. Error: {str(conversion_error)[:200]}...</p><p>You can try downloading the file directly.</p></body></html>",
-                            status_code=500
-                        )
+                # Cache hit: serve the stored preview without starting LibreOffice
+                cache_key = await run_in_threadpool(preview_cache.key_for, valid_src_path, f"html-{images}")
+                cached_dir = await run_in_threadpool(preview_cache.get, cache_key)
+                if cached_dir is not None:
+                    logger.info(f"Serving cached HTML preview for {valid_src_path.name}")
+                    return FileResponse(path=cached_dir / PREVIEW_HTML_NAME, media_type="text/html", content_disposition_type="inline")
+
+                try:
+                    # Conversion runs on the conversion thread pool, off the event loop.
+                    # The rewritten HTML goes straight to the cache and is streamed from there.
+                    preview_html_path = await conversion_limiter.run(
+                        build_html_preview, valid_src_path, cache_key, images
+                    )
+                    return FileResponse(path=preview_html_path, media_type="text/html", content_disposition_type="inline")
+                except (RuntimeError, FileNotFoundError) as conversion_error:
+                    logger.error(f"HTML conversion failed for {valid_src_path.name}: {conversion_error}")
+                    return HTMLResponse(
+                        content=f"<html><body><h1>Preview Unavailable</h1><p>Could not generate a preview for {valid_src_path.name}. Error: {str(conversion_error)[:200]}...</p><p>You can try downloading the file directly.</p></body></html>",
+                        status_code=500
+                    )
             
             # --- PPT/PPTX to PDF ---
             # *** NEW ***
             elif file_extension in [".ppt", ".pptx"] and LIBREOFFICE_PATH:
-                with tempfile.TemporaryDirectory(prefix="lo_pdf_convert_") as tmp_dir_str:
-                    tmp_output_dir = Path(tmp_dir_str)
-                    try:
-                        # LibreOffice command for PDF conversion
-                        cmd_pdf = [
-                            LIBREOFFICE_PATH, "--headless", "--nolockcheck", "--nodefault",
-                            "--norestore", "--invisible",
-                            "--convert-to", "pdf:writer_pdf_Export", # Specific PDF export filter
-                            "--outdir", str(tmp_output_dir), str(valid_src_path)
-                        ]
-                        process_pdf = subprocess.run(cmd_pdf, check=True, timeout=180, capture_output=True, text=True, errors='replace')
-                        if process_pdf.stderr:
-                            logger.info(f"LibreOffice PDF conversion STDERR for {valid_src_path.name}: {process_pdf.stderr[:1000]}")
-
-                        pdf_filename = valid_src_path.stem + ".pdf"
-                        converted_pdf_path = tmp_output_dir / pdf_filename
-
-                        if not converted_pdf_path.is_file():
-                            # Fallback: search for any .pdf file
-                            pdf_files = list(tmp_output_dir.glob("*.pdf"))
-                            if not pdf_files:
-                                raise FileNotFoundError("LibreOffice PDF conversion failed: No PDF file found.")
-                            converted_pdf_path = pdf_files[0]
-                            logger.warning(f"Expected PDF file '{pdf_filename}' not found. Using first found: '{converted_pdf_path.name}'")
-                        
-                        logger.info(f"Successfully converted '{valid_src_path.name}' to PDF: '{converted_pdf_path}'")
-                        return FileResponse(
-                            path=converted_pdf_path,
-                            media_type="application/pdf",
-                            filename=valid_src_path.stem + ".pdf", # Suggest a filename for the browser
-                            content_disposition_type="inline" # Tell browser to display inline
-                        )
+                cache_key = await run_in_threadpool(preview_cache.key_for, valid_src_path, "pdf")
+                # The key changes with the source file, so it doubles as a strong ETag
+                etag = f'"{cache_key}"'
+                if etag_matches(request, etag):
+                    return Response(status_code=304, headers={"ETag": etag})
+
+                cached_dir = await run_in_threadpool(preview_cache.get, cache_key)
+                try:
+                    if cached_dir is not None:
+                        logger.info(f"Serving cached PDF preview for {valid_src_path.name}")
+                        converted_pdf_path = cached_dir / PREVIEW_PDF_NAME
+                    else:
+                        converted_pdf_path = await conversion_limiter.run(build_pdf_preview, valid_src_path, cache_key)
 
+                    # Range support lets PDF viewers fetch the pages they show instead of the whole deck
+                    return ranged_file_response(
+                        request, converted_pdf_path, "application/pdf", etag,
+                        filename=valid_src_path.stem + ".pdf", # Suggest a filename for the browser
+                    )
+
+                   # HIGHLIGHTED CHANGE SECTION: PPT/PPTX Conversion Error Handling
+                except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError, RuntimeError) as conversion_error:
+                    logger.error(f"PDF conversion failed for {valid_src_path.name}: {conversion_error}")
                     
-                       # HIGHLIGHTED CHANGE SECTION: PPT/PPTX Conversion Error Handling
-                    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError, RuntimeError) as conversion_error:
-                        logger.error(f"PDF conversion failed for {valid_src_path.name}: {conversion_error}")
-                        
-                        # Instead of returning the original file, return an HTML error page
-                        # You can make this HTML more elaborate if needed
-                        error_html_content = f"""
-                        <html>
-                            <head><title>Preview Error</title></head>
-                            <body style="font-family: sans-serif; padding: 20px;">
-                                <h1>PDF Preview Unavailable</h1>
-                                <p>Could not generate a PDF preview for the file: <strong>{valid_src_path.name}</strong>.</p>
-                                <p>Reason: {str(conversion_error)[:250]}...</p>
-                                <p>You can try downloading the original file instead.</p>
-                                <!-- Optional: Add a direct link to download the original file -->
-                                <!-- This would require knowing the base URL or constructing it carefully -->
-                                <!-- <p><a href="/api/documents/{file_path}?action=download">Download Original File ({valid_src_path.name})</a></p> -->
-                                <p><button onclick="window.close()">Close Tab</button></p>
-                            </body>
-                        </html>
-                        """
-                        return HTMLResponse(content=error_html_content, status_code=500)
-                    # END OF HIGHLIGHTED CHANGE SECTION
+                    # Instead of returning the original file, return an HTML error page
+                    # You can make this HTML more elaborate if needed
+                    error_html_content = f"""
+                    <html>
+                        <head><title>Preview Error</title></head>
+                        <body style="font-family: sans-serif; padding: 20px;">
+                            <h1>PDF Preview Unavailable</h1>
+                            <p>Could not generate a PDF preview for the file: <strong>{valid_src_path.name}</strong>.</p>
+                            <p>Reason: {str(conversion_error)[:250]}...</p>
+                            <p>You can try downloading the original file instead.</p>
+                            <!-- Optional: Add a direct link to download the original file -->
+                            <!-- This would require knowing the base URL or constructing it carefully -->
+                            <!-- <p><a href="/api/documents/{file_path}?action=download">Download Original File ({valid_src_path.name})</a></p> -->
+                            <p><button onclick="window.close()">Close Tab</button></p>
+                        </body>
+                    </html>
+                    """
+                    return HTMLResponse(content=error_html_content, status_code=500)
+                # END OF HIGHLIGHTED CHANGE SECTION
             
             elif file_extension == ".html":
                 return FileResponse(path=valid_src_path, media_type="text/html", content_disposition_type="inline")
@@ -312,6 +591,8 @@ async def get_document(
                 logger.info(f"Attempting inline view for '{valid_src_path.name}' (MIME: {mime_type}). Browser may download.")
                 return FileResponse(path=valid_src_path, media_type=mime_type, content_disposition_type="inline", filename=valid_src_path.name)
 
+    except HTTPException:
+        raise
     except PermissionError:
         logger.error(f"Permission denied accessing file: {valid_src_path}")
         raise HTTPException(status_code=403, detail="Server does not have permission to access this file.")
@@ -0,0 +1,207 @@
+"""
+Prometheus metrics for search.py and main.py, served by their /metrics
+endpoints in the text exposition format (version 0.0.4).
+
+Stage histograms are defined here; the apps time their stages with
+`HISTOGRAM.time("stage")`. Live values owned by other objects (caches, the
+conversion limiter) are read when /metrics is scraped, through
+`register_gauge` / `register_cache`.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Search stages are milliseconds, conversions are seconds to minutes
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = FAST_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts..., sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str) -> Iterator[None]:
+        """Observes the wall time of the block, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labelvalues)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labelvalues, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = ("le", _format_value(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labelvalues, le)} {cumulative}")
+            labels = _labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """
+    Gauge or counter whose samples come from `collect()` at scrape time, as
+    {label values tuple: value}.
+    """
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Sequence[str],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labelvalues, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+
+    def register(self, metric):
+        # Re-registering a name replaces the old metric (e.g. a module loaded twice)
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+# --- Named caches and gauges -----------------------------------------------
+_caches: Dict[str, object] = {}
+_gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+
+def register_cache(name: str, cache) -> None:
+    """
+    Exposes hits/misses and the hit ratio of any cache with `hits` and `misses` counters.
+    """
+    _caches[name] = cache
+
+
+def register_gauge(name: str, documentation: str, read: Callable[[], float]) -> None:
+    """
+    Adds an unlabelled gauge read at scrape time.
+    """
+    REGISTRY.register(CallbackMetric(name, documentation, "gauge", (), lambda: {(): read()}))
+
+
+def _cache_samples(attr: str) -> Dict[Tuple[str, ...], float]:
+    return {(name,): getattr(cache, attr) for name, cache in _caches.items()}
+
+
+def _cache_hit_ratios() -> Dict[Tuple[str, ...], float]:
+    ratios = {}
+    for name, cache in _caches.items():
+        lookups = cache.hits + cache.misses
+        ratios[(name,)] = cache.hits / lookups if lookups else 0.0
+    return ratios
+
+
+REGISTRY.register(CallbackMetric("cache_hits_total", "Cache lookups that found an entry.", "counter",
+                                 ("cache",), lambda: _cache_samples("hits")))
+REGISTRY.register(CallbackMetric("cache_misses_total", "Cache lookups that found nothing.", "counter",
+                                 ("cache",), lambda: _cache_samples("misses")))
+REGISTRY.register(CallbackMetric("cache_hit_ratio", "Hits / lookups since the process started.", "gauge",
+                                  ("cache",), _cache_hit_ratios))
+
+
+# --- Stage histograms ------------------------------------------------------
+SEARCH_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "search_stage_seconds",
+    "Time per stage of search_elasticsearch (build_query, cache_lookup, es_request, parse_json, process_hits).",
+    ("stage",),
+))
+ATTACHMENT_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "attachment_link_stage_seconds",
+    "Time per stage of /handle-attachment-link (build_query, es_request, parse_json, process_hits).",
+    ("stage",),
+))
+ATTACHMENT_BATCH_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "attachment_links_batch_stage_seconds",
+    "Time per stage of /handle-attachment-links (build_query, es_request, parse_json, process_hits).",
+    ("stage",),
+))
+CONVERSION_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "libreoffice_conversion_stage_seconds",
+    "Time per stage of a LibreOffice conversion (libreoffice, locate_output) by output format.",
+    ("output", "stage"), buckets=SLOW_BUCKETS,
+))
+PREVIEW_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "preview_build_stage_seconds",
+    "Time per stage of building a cached preview (convert, write_html, publish) by output format.",
+    ("output", "stage"), buckets=SLOW_BUCKETS,
+))
+EMBED_IMAGE_STAGE_SECONDS = REGISTRY.register(Histogram(
+    "embed_images_stage_seconds",
+    "Time per image in embed_images_as_base64 (resolve, read, encode).",
+    ("stage",),
+))
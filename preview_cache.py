@@ -0,0 +1,245 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", os.path.join(tempfile.gettempdir(), "doc_preview_cache"))
+PREVIEW_CACHE_MAX_BYTES = int(os.getenv("PREVIEW_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))  # 2 GiB
+# "stat" keys on resolved path + size + mtime, "hash" on the file contents
+PREVIEW_CACHE_KEY_MODE = os.getenv("PREVIEW_CACHE_KEY_MODE", "stat")
+
+_STAGING_DIR_NAME = ".staging"
+# Staging dirs older than this are leftovers of a crashed build (conversions time out well before)
+_STAGING_MAX_AGE_SECONDS = 3600
+# Entries used or published this recently are not evicted: a request that just
+# got one from get() may not have opened its files yet
+_EVICT_GRACE_SECONDS = 60
+
+
+def file_identity(source_file: Path, use_content_hash: bool = False) -> str:
+    """
+    Returns a string that changes whenever the file behind `source_file` changes.
+    """
+    resolved = source_file.resolve()
+    if use_content_hash:
+        digest = hashlib.sha256()
+        with open(resolved, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return f"sha256:{digest.hexdigest()}"
+    stat = resolved.stat()
+    return f"{resolved}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class PreviewCache:
+    """
+    Content-addressed on-disk cache of converted previews.
+
+    Each entry is a directory named after its key. Entries are built in a
+    staging directory and renamed into place, so readers never see a partial
+    entry. The least recently used entries are evicted once the total size
+    goes over `max_bytes`, except those used in the last _EVICT_GRACE_SECONDS
+    (the cache can briefly exceed `max_bytes` when everything is that recent).
+
+    Several worker processes may share one cache directory. The in-process
+    index is only a shortcut: entries published by other workers are adopted
+    from disk when looked up, and eviction works from what is on disk.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, key_mode: str = "stat"):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.key_mode = key_mode
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size in bytes, oldest first
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = self.root / _STAGING_DIR_NAME
+        staging.mkdir(exist_ok=True)
+        self._remove_stale_staging(staging)
+        self._load_index()
+
+    @staticmethod
+    def _remove_stale_staging(staging: Path) -> None:
+        # Other workers may be building entries in here right now; only old leftovers go
+        cutoff = time.time() - _STAGING_MAX_AGE_SECONDS
+        for item in staging.iterdir():
+            try:
+                if item.stat().st_mtime < cutoff:
+                    shutil.rmtree(item, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+    def _load_index(self) -> None:
+        entries = []
+        for item in self.root.iterdir():
+            if item.is_dir() and item.name != _STAGING_DIR_NAME:
+                entries.append((item.stat().st_mtime, item.name, _dir_size(item)))
+        for _mtime, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+        logger.info(f"Preview cache at {self.root}: {len(self._entries)} entries, {self._total_bytes} bytes")
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def key_for(self, source_file: Path, variant: str) -> str:
+        """
+        Cache key for one rendering (`variant`, e.g. "html" or "pdf") of a source file.
+        """
+        identity = file_identity(source_file, use_content_hash=self.key_mode == "hash")
+        return hashlib.sha256(f"{variant}|{identity}".encode("utf-8")).hexdigest()
+
+    def _adopt(self, key: str, entry_dir: Path) -> None:
+        """
+        Adds an entry another worker published to this process's index.
+        """
+        size = _dir_size(entry_dir)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self._total_bytes += size
+
+    def get(self, key: str) -> Optional[Path]:
+        """
+        Returns the entry directory on a hit (and marks it recently used), None on a miss.
+        """
+        with self._lock:
+            known = key in self._entries
+            if known:
+                self._entries.move_to_end(key)
+        entry_dir = self.locate(key)
+        try:
+            if entry_dir is None:
+                raise FileNotFoundError(key)
+            os.utime(entry_dir)  # LRU order, shared with the other workers and across restarts
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+            return None
+        if not known:
+            self._adopt(key, entry_dir)
+        with self._lock:
+            self.hits += 1
+        return entry_dir
+
+    def locate(self, key: str) -> Optional[Path]:
+        """
+        The entry directory if it is on disk, whichever worker published it.
+        Unlike get(), does not count a hit/miss or mark the entry used.
+        """
+        if key == _STAGING_DIR_NAME or not key or os.sep in key or key in (".", ".."):
+            return None
+        entry_dir = self.root / key
+        return entry_dir if entry_dir.is_dir() else None
+
+    @contextmanager
+    def staging(self) -> Iterator[Path]:
+        """
+        Yields a scratch directory on the cache filesystem for building an entry.
+        Anything left in it (i.e. not published) is removed on exit.
+        """
+        staging_dir = Path(tempfile.mkdtemp(dir=self.root / _STAGING_DIR_NAME))
+        try:
+            yield staging_dir
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def publish(self, key: str, staging_dir: Path) -> Path:
+        """
+        Atomically moves a fully built staging directory into the cache under `key`.
+        """
+        entry_dir = self.root / key
+        size = _dir_size(staging_dir)
+        try:
+            os.rename(staging_dir, entry_dir)
+        except OSError:
+            if entry_dir.is_dir():
+                # Another worker published the same key first; keep theirs
+                self._adopt(key, entry_dir)
+                return entry_dir
+            raise
+        os.utime(entry_dir)  # newest in the shared LRU order
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= previous
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+        return entry_dir
+
+    def _scan(self) -> "OrderedDict[str, int]":
+        """
+        Entries currently on disk, least recently used first, with their sizes
+        (reused from the index where known; entries never change once published).
+        """
+        on_disk = []
+        for item in self.root.iterdir():
+            if item.name == _STAGING_DIR_NAME:
+                continue
+            try:
+                if item.is_dir():
+                    on_disk.append((item.stat().st_mtime, item.name))
+            except FileNotFoundError:
+                pass  # evicted by another worker meanwhile
+        with self._lock:
+            known = dict(self._entries)
+        entries: "OrderedDict[str, int]" = OrderedDict()
+        for _mtime, key in sorted(on_disk):
+            size = known.get(key)
+            entries[key] = size if size is not None else _dir_size(self.root / key)
+        return entries
+
+    def _evict(self) -> None:
+        # Other workers add to and evict from the same directory, so the total
+        # comes from disk rather than from this process's own bookkeeping
+        entries = self._scan()
+        cutoff = time.time() - _EVICT_GRACE_SECONDS
+        victims = []
+        with self._lock:
+            self._entries = entries
+            self._total_bytes = sum(entries.values())
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                key = next(iter(self._entries))
+                try:
+                    if (self.root / key).stat().st_mtime > cutoff:
+                        break  # this and every later entry were used within the grace window
+                except FileNotFoundError:
+                    pass  # already evicted by another worker
+                size = self._entries.pop(key)
+                self._total_bytes -= size
+                victims.append(key)
+        for key in victims:
+            shutil.rmtree(self.root / key, ignore_errors=True)
+            logger.info(f"Evicted preview cache entry {key}")
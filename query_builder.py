@@ -0,0 +1,227 @@
+"""
+Builds the Elasticsearch DSL for /search.
+
+Only the free-text clauses are scored. Filters and the date range go into
+bool.filter, where ES can cache them in the node query cache. Clauses are
+normalized (deduplicated, sorted values, day-aligned dates) so that equal
+requests compile to byte-identical DSL.
+"""
+import json
+import os
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+
+# Id/name fields are native keyword fields in the index template (index_template.py)
+PROP_ID_FIELD = "PropId"
+PARENT_PROP_ID_FIELD = "ParentPropId"
+SEARCH_FIELDS_KEYWORDS = ["OriginalName", PROP_ID_FIELD, PARENT_PROP_ID_FIELD]
+TEXT_FIELD = "Text"
+DATE_FIELD = "DocumentDate"
+
+# _source profile for result lists: everything except the large extracted-text
+# fields (only returned by the /documents/{PropId} detail endpoint) and the
+# parsed attachment path list (the count is enough for a list)
+RESULT_LIST_SOURCE = {"excludes": ["Text", "TransliteratedText", "AttachmentPaths"]}
+# Characters of Text returned as the snippet when a hit has no highlight
+SNIPPET_NO_MATCH_SIZE = 100
+SNIPPET_FRAGMENT_SIZE = 500
+
+# Highlight profiles, chosen per endpoint:
+#   none    - no highlighting (export, cursor-only paging, lean attachment lookups)
+#   snippet - the single best fragment a result list shows under each hit
+#   full    - all of Text with every match marked (document detail view, on request)
+HIGHLIGHT_NONE = "none"
+HIGHLIGHT_SNIPPET = "snippet"
+HIGHLIGHT_FULL = "full"
+HIGHLIGHT_PROFILES = (HIGHLIGHT_NONE, HIGHLIGHT_SNIPPET, HIGHLIGHT_FULL)
+# Highlighting stops after this many characters of a long Text instead of failing
+# the request (the index's own index.highlight.max_analyzed_offset still applies)
+HIGHLIGHT_MAX_ANALYZED_OFFSET = int(os.getenv("HIGHLIGHT_MAX_ANALYZED_OFFSET", "1000000"))
+
+# Same as the index sort, which lets ES terminate collection early
+DEFAULT_SORT = [
+    {DATE_FIELD: "desc"},
+    {PROP_ID_FIELD: "asc"}
+]
+
+
+class QueryBuildError(ValueError):
+    """Raised for requests that cannot be turned into a query (bad search_type, dates, ...)."""
+
+
+def keyword_field(field: str) -> str:
+    # Older clients still send the dynamic-mapping "Field.keyword" names
+    return field.removesuffix(".keyword")
+
+
+def _parse_day(value: str, what: str) -> datetime:
+    """
+    Accepts "YYYY-MM-DD" or a full ISO timestamp; returns the start of that UTC day.
+    Rounding to whole days keeps range clauses identical across requests.
+    """
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise QueryBuildError(f"Invalid date_range.{what}: {value!r} (expected YYYY-MM-DD)")
+    return datetime.combine(parsed.date(), time.min, tzinfo=timezone.utc)
+
+
+def to_epoch_seconds(dt: datetime) -> int:
+    return int(dt.timestamp())
+
+
+def _unique(items: List[Any]) -> List[Any]:
+    """Order-preserving dedup for JSON-able items."""
+    seen = set()
+    result = []
+    for item in items:
+        marker = json.dumps(item, sort_keys=True)
+        if marker not in seen:
+            seen.add(marker)
+            result.append(item)
+    return result
+
+
+def text_clause(q: str) -> dict:
+    """
+    One search term: phrase match on the text or an exact match on an id/name field.
+    """
+    sub_clauses = [{"match_phrase": {TEXT_FIELD: q}}]
+    for field in SEARCH_FIELDS_KEYWORDS:
+        sub_clauses.append({"term": {field: q}})
+    return {"bool": {"should": sub_clauses, "minimum_should_match": 1}}
+
+
+def filter_clauses(filters: Optional[Dict[str, List[str]]]) -> List[dict]:
+    """
+    One terms clause per field, values deduplicated and sorted. Fields given both
+    with and without a .keyword suffix are merged.
+    """
+    merged: Dict[str, set] = {}
+    for field, values in (filters or {}).items():
+        if not values:  # only if list is non-empty
+            continue
+        if isinstance(values, str):
+            values = [values]
+        merged.setdefault(keyword_field(field), set()).update(str(v) for v in values)
+    return [{"terms": {field: sorted(values)}} for field, values in sorted(merged.items())]
+
+
+def date_range_clause(date_range: Optional[Dict[str, str]]) -> Optional[dict]:
+    """
+    DocumentDate range in epoch seconds, rounded outwards to whole UTC days:
+    from the start of the "from" day up to (excluding) the day after "to".
+    """
+    if not date_range:
+        return None
+    range_filter = {}
+    if date_range.get("from"):
+        range_filter["gte"] = to_epoch_seconds(_parse_day(date_range["from"], "from"))
+    if date_range.get("to"):
+        next_day = _parse_day(date_range["to"], "to") + timedelta(days=1)
+        range_filter["lt"] = to_epoch_seconds(next_day)
+    if not range_filter:
+        return None
+    return {"range": {DATE_FIELD: range_filter}}
+
+
+def build_query(
+    queries: List[str],
+    search_type: str = "any",
+    filters: Optional[Dict[str, List[str]]] = None,
+    date_range: Optional[Dict[str, str]] = None
+) -> dict:
+    """
+    Compiles the bool query: text clauses scored in must ("all") or should ("any"),
+    every other constraint in filter context.
+    """
+    if not queries:
+        raise QueryBuildError("Query list cannot be empty")
+    if search_type not in ("any", "all"):
+        raise QueryBuildError("Invalid search_type. Use 'any' or 'all'.")
+
+    text_clauses = _unique([text_clause(q) for q in queries])
+
+    constraints = filter_clauses(filters)
+    date_clause = date_range_clause(date_range)
+    if date_clause:
+        constraints.append(date_clause)
+
+    bool_query: Dict[str, Any] = {}
+    if search_type == "all":
+        bool_query["must"] = text_clauses
+    else:
+        bool_query["should"] = text_clauses
+        bool_query["minimum_should_match"] = 1
+    if constraints:
+        bool_query["filter"] = _unique(constraints)
+
+    return {"bool": bool_query}
+
+
+def parse_highlight_profile(value: Any, default: str = HIGHLIGHT_SNIPPET) -> str:
+    if value is None:
+        return default
+    if value not in HIGHLIGHT_PROFILES:
+        raise QueryBuildError(f"Invalid highlight: {value!r} (expected one of {', '.join(HIGHLIGHT_PROFILES)})")
+    return value
+
+
+def text_highlight_query(queries: List[str]) -> dict:
+    """
+    Marks the search terms in Text for requests whose own query selects
+    documents by id (attachments, document detail).
+    """
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) for q in queries):
+        raise QueryBuildError("Invalid 'queries' for highlighting (expected a list of strings)")
+    phrases = _unique([{"match_phrase": {TEXT_FIELD: q}} for q in queries])
+    return {"bool": {"should": phrases, "minimum_should_match": 1}}
+
+
+def highlight_clause(profile: str, highlight_query: Optional[dict] = None) -> Optional[dict]:
+    """
+    The request's "highlight" section for a profile, None for HIGHLIGHT_NONE.
+    highlight_query marks the search terms when the request's own query does
+    not contain them (e.g. a lookup by PropId).
+    """
+    if profile == HIGHLIGHT_NONE:
+        return None
+    if profile == HIGHLIGHT_FULL:
+        # 0 fragments: the whole field comes back as one highlighted fragment
+        field = {"number_of_fragments": 0}
+    else:
+        field = {
+            "fragment_size": SNIPPET_FRAGMENT_SIZE,
+            "number_of_fragments": 1,
+            "boundary_scanner": "sentence",
+            "no_match_size": SNIPPET_NO_MATCH_SIZE
+        }
+    field["max_analyzed_offset"] = HIGHLIGHT_MAX_ANALYZED_OFFSET
+    if highlight_query is not None:
+        field["highlight_query"] = highlight_query
+    return {
+        "fields": {TEXT_FIELD: field},
+        "pre_tags": ["<mark>"],
+        "post_tags": ["</mark>"]
+    }
+
+
+def build_search_body(query: dict, size: int, search_after: Optional[List] = None,
+                      highlight: str = HIGHLIGHT_SNIPPET) -> dict:
+    """
+    Full request body for one page of /search results.
+    """
+    search_body = {
+        "size": size,
+        "sort": DEFAULT_SORT,
+        "track_total_hits": True,
+        "query": query,
+        "_source": RESULT_LIST_SOURCE,
+    }
+    highlight_section = highlight_clause(highlight)
+    if highlight_section is not None:
+        search_body["highlight"] = highlight_section
+    if search_after:
+        search_body["search_after"] = search_after
+    return search_body
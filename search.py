@@ -1,19 +1,34 @@
 
 from fastapi import FastAPI, Query, HTTPException,Body
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from typing import List, Optional, AsyncGenerator,Dict, Any,Tuple
 from starlette.responses import StreamingResponse
 import httpx
+import asyncio
 import logging
 import os
+import time
 from dotenv import load_dotenv
-import json 
-from datetime import datetime,timezone,time,timedelta
-import re
+
+from content_dedup import CANONICAL_FIELD, DEDUPLICATED_FIELDS
+from doc_fields import split_attachment_paths
+from search_cache import GenerationCounter, TTLCache, make_cache_key
+from query_builder import (
+    QueryBuildError, DEFAULT_SORT, HIGHLIGHT_FULL, HIGHLIGHT_NONE, HIGHLIGHT_SNIPPET, PARENT_PROP_ID_FIELD,
+    PROP_ID_FIELD, RESULT_LIST_SOURCE, build_query, build_search_body, highlight_clause,
+    parse_highlight_profile, text_highlight_query,
+)
+from es_client import es_lifespan, get_es_client, ES_SEARCH_TIMEOUT, ES_ATTACHMENT_TIMEOUT
+from json_codec import FastJSONResponse, dumps_line, iter_ndjson_chunks, loads
+from log_setup import RequestContextMiddleware, configure_logging
+from metrics import (
+    ATTACHMENT_BATCH_STAGE_SECONDS, ATTACHMENT_STAGE_SECONDS, CONTENT_TYPE as METRICS_CONTENT_TYPE, SEARCH_STAGE_SECONDS,
+    register_cache, render_metrics,
+)
 
 
-app = FastAPI()
+app = FastAPI(lifespan=es_lifespan, default_response_class=FastJSONResponse)
 
 
 
@@ -23,19 +38,15 @@ app.add_middleware(
     allow_origins=["*"],  # change this when you run on production
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"],)
+    allow_headers=["*"],
+    expose_headers=["X-Request-ID"],)
+app.add_middleware(RequestContextMiddleware)
 
 
 
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-    handlers=[
-        logging.FileHandler("logs/app.log"),         # Write to logs/app.log
-        logging.StreamHandler()                      # Also print to console
-    ]
-)
+# Logging setup: JSON lines to logs/app.log and the console, written by a
+# background thread (see log_setup for LOG_LEVEL, LOG_FILE, LOG_FORMAT)
+configure_logging()
 
 logger = logging.getLogger(__name__)
 
@@ -47,134 +58,186 @@ logger = logging.getLogger(__name__)
 
 
 # Elasticsearch configuration
-ES_HOST = "http://localhost:9200/"
-ES_INDEX = "document_index"
+ES_HOST = os.getenv("ES_HOST", "http://localhost:9200/").rstrip("/") + "/"
+ES_INDEX = os.getenv("ES_INDEX", "document_index")
+
+
+
+idx_url = f"{ES_HOST}{ES_INDEX}"
+
+# Attachment lookups: page size (override per request with "size"), capped at MAX_ATTACHMENT_RESULTS
+MAX_ATTACHMENT_RESULTS = int(os.getenv("MAX_ATTACHMENT_RESULTS", "1000"))
+ATTACHMENT_PAGE_SIZE = int(os.getenv("ATTACHMENT_PAGE_SIZE", str(MAX_ATTACHMENT_RESULTS)))
+MAX_ATTACHMENT_BATCH = int(os.getenv("MAX_ATTACHMENT_BATCH", "200"))
+
+# Facets: terms aggregations returned under "aggregations", cached per query
+FACET_FIELDS = {
+    "doctype_counts": "DocType",
+    "branchtype_counts": "Branch",
+    "extensiontype_counts": "FileExtension",
+}
+FACET_SIZE = 100
+FACET_CACHE_TTL = float(os.getenv("FACET_CACHE_TTL", "300"))
+
+# Ingestion bumps the generation (see search_cache.bump_search_generation) to invalidate both caches
+index_generation = GenerationCounter()
+facet_cache = TTLCache(max_entries=int(os.getenv("FACET_CACHE_MAX_ENTRIES", "1000")), ttl=FACET_CACHE_TTL,
+                       generation=index_generation)
+
+# Query results, keyed by the generated search body
+search_cache = TTLCache(
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "60")),
+    max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    generation=index_generation,
+)
 
+register_cache("search_results", search_cache)
+register_cache("search_facets", facet_cache)
 
+# Bulk export (stream=True) settings
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "1000"))
+EXPORT_PIT_KEEP_ALIVE = os.getenv("EXPORT_PIT_KEEP_ALIVE", "2m")
+# NDJSON is sent in chunks of about this many bytes rather than a write per document or per page
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", str(256 * 1024)))
 
-idx_url="http://localhost:9200/document_index"
+def parse_is_attachment(value: Any) -> bool:
+    if value == "False":
+        return False
+    return bool(value)
 
-def to_epoch_millis(date_str):
-    dt_naive=datetime.strptime(date_str,"%Y-%m-%d")
-    dt_aware_utc=datetime.combine(dt_naive.date(),time.min,tzinfo=timezone.utc)
-    return int(dt_aware_utc.timestamp())
 
+def build_attachment_query(
+    PropId: Optional[str],
+    ParentPropId: Optional[str],
+    is_attachment: bool,
+    size: Optional[int] = None,
+    search_after: Optional[List] = None,
+    lean: bool = False,
+    highlight: str = HIGHLIGHT_SNIPPET,
+    highlight_query: Optional[dict] = None
+) -> dict:
+    """
+    For an attachment: its parent (PropId == ParentPropId).
+    For a main document: one page of its attachments (ParentPropId == PropId),
+    continued with search_after.
+    The lookup itself has no search terms, so Text is only highlighted when the
+    caller passes them (highlight_query). lean skips highlighting and leaves
+    the extracted text out of _source.
+    """
+    if is_attachment:
+        term = {PROP_ID_FIELD: ParentPropId}
+        size = 1
+    else:
+        term = {PARENT_PROP_ID_FIELD: PropId}
+        size = min(size or ATTACHMENT_PAGE_SIZE, MAX_ATTACHMENT_RESULTS)
+
+    query = {
+        "query": {"bool": {"filter": [{"term": term}]}},
+        "sort": DEFAULT_SORT,
+        "size": size
+    }
+    if lean:
+        query["_source"] = RESULT_LIST_SOURCE
+    elif highlight_query is not None:
+        highlight_section = highlight_clause(highlight, highlight_query)
+        if highlight_section is not None:
+            query["highlight"] = highlight_section
+    if search_after and not is_attachment:
+        query["search_after"] = search_after
+    return query
+
+
+def attachment_page_size(value: Any) -> Optional[int]:
+    return value if isinstance(value, int) and value > 0 else None
+
+
+def attachment_next_search_after(raw_hits: List[dict], size: int, is_attachment: bool) -> Optional[List]:
+    # A full page of attachments means there may be more; a short page is the last one
+    if not is_attachment and raw_hits and len(raw_hits) >= size:
+        return raw_hits[-1]["sort"]
+    return None
+
+
+def process_attachment_hits(raw_hits: List[dict]) -> List[dict]:
+    documents = []
+    for hit in raw_hits:
+        source = hit["_source"]
+        highlight = hit.get("highlight", {}).get("Text", [])
+        if highlight:
+            source["highlighted_text"] = highlight[0]
+        else:
+            source["highlighted_text"] = source.get("Text", "")
+        documents.append(source)
+    return documents
+
+
+def highlight_profile(value: Any, default: str) -> str:
+    try:
+        return parse_highlight_profile(value, default)
+    except QueryBuildError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
+def attachment_highlight(payload: Dict[str, Any]) -> Tuple[str, Optional[dict]]:
+    """
+    Attachment lookups highlight the caller's search terms ("queries") with
+    the "highlight" profile (snippet by default); without terms, nothing.
+    """
+    highlight = highlight_profile(payload.get("highlight"), HIGHLIGHT_SNIPPET)
+    queries = payload.get("queries")
+    if not queries or highlight == HIGHLIGHT_NONE:
+        return highlight, None
+    try:
+        return highlight, text_highlight_query(queries)
+    except QueryBuildError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.post("/handle-attachment-link")
 async def handle_attachment_link(payload: Dict[str, Any] = Body(...)):
-    print("hello")
     PropId = payload.get("app_id")
     ParentPropId = payload.get("parent_app_id")
-    is_attachment = payload.get("is_attachment")
-
-
-    # check once with sir
-    MAX_ATTACHMENT_RESULTS=1000
-    
-    print(f"{PropId}, {ParentPropId}re, {is_attachment}")
-    if is_attachment=="False":
-        is_attachment=0
+    is_attachment = parse_is_attachment(payload.get("is_attachment"))
 
     if PropId is None and ParentPropId is None:
         raise HTTPException(status_code=400, detail="Required fields missing: app_id, parent_app_id, is_attachment")
-
-    if is_attachment:
-        print(f"{ParentPropId} hello")
-        # If it is an attachment, find parent where AppId == ParentAppId
-        
-
-        query={ "query": {
-            "bool": {
-              "must": [
-                {
-                  "term": {
-                    "PropId.keyword": ParentPropId
-                  }
-                }
-              ],
-              "must_not": [],
-              "should": []
-            }
-          },
-          "highlight":{
-          "fields":{
-           "Text": {}
-          }
-          },
-          "sort": [
-            {"DocumentDate": "desc"},
-            {"_id": "asc"}
-              ],
-          "size": 1  }
-
-        
-    else:
-        # If it is a main doc, find all attachments where ParentAppId == AppId
-        query={ "query": {
-            "bool": {
-              "must": [
-                {
-                  "term": {
-                    "ParentPropId.keyword": PropId
-                  }
-                }
-              ],
-              "must_not": [],
-              "should": []
-            }
-          },
-          "highlight":{
-          "fields":{
-           "Text": {}
-          }
-          },
-          "size": MAX_ATTACHMENT_RESULTS,
-          "sort": [
-            {"DocumentDate": "desc"},
-            {"_id": "asc"}
-                     ]  }
-
-        
+    search_after = payload.get("search_after")
+    if search_after is not None and not isinstance(search_after, list):
+        raise HTTPException(status_code=400, detail="Invalid search_after: expected a list")
+
+    with ATTACHMENT_STAGE_SECONDS.time("build_query"):
+        highlight, highlight_query = attachment_highlight(payload)
+        query = build_attachment_query(
+            PropId, ParentPropId, is_attachment,
+            size=attachment_page_size(payload.get("size")),
+            search_after=search_after,
+            lean=bool(payload.get("lean", False)),
+            highlight=highlight, highlight_query=highlight_query
+        )
 
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            url = f"{idx_url}/_search"
-            response = await client.post(url, json=query)
-
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Elasticsearch error: {response.status_code} - {response.text}"
-                )
-
-        data = response.json()
+        client = get_es_client()
+        url = f"{idx_url}/_search"
+        with ATTACHMENT_STAGE_SECONDS.time("es_request"):
+            response = await client.post(url, json=query, timeout=ES_ATTACHMENT_TIMEOUT)
+
+        if response.status_code != 200:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Elasticsearch error: {response.status_code} - {response.text}"
+            )
+
+        with ATTACHMENT_STAGE_SECONDS.time("parse_json"):
+            data = loads(response.content)
         raw_hits = data.get("hits", {}).get("hits", [])
+        with ATTACHMENT_STAGE_SECONDS.time("process_hits"):
+            documents = process_attachment_hits(raw_hits)
 
-        # Process highlights
-        processed_hits = []
-        for hit in raw_hits:
-            source = hit["_source"]
-            highlight = hit.get("highlight", {}).get("Text", [])
-            if highlight:
-                source["highlighted_text"] = highlight[0]
-            else:
-                source["highlighted_text"] = source.get("Text", "")
-            
-            processed_hit = {
-                **hit,
-                "_source": source
-            }
-            processed_hits.append(processed_hit)
-
-        documents = [hit["_source"] for hit in processed_hits]
-        
-        # handle the case where there might be 100 attactcments
-        return JSONResponse(content={
+        # Parents with many attachments are paged with search_after
+        return FastJSONResponse(content={
             "documents": documents,
-            "next_search_after": None
+            "next_search_after": attachment_next_search_after(raw_hits, query["size"], is_attachment)
         })
     except httpx.RequestError as e:
         logger.error(f"Elasticsearch connection error: {str(e)}")
@@ -184,167 +247,151 @@ async def handle_attachment_link(payload: Dict[str, Any] = Body(...)):
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@app.post("/handle-attachment-links")
+async def handle_attachment_links(payload: Dict[str, Any] = Body(...)):
+    """
+    Batch form of /handle-attachment-link. Takes {"items": [{app_id, parent_app_id,
+    is_attachment, size, search_after}, ...]} and resolves every item in a single _msearch.
+    Returns {"results": {app_id (or parent_app_id): {"documents": [...], "next_search_after": ...}
+    or {"error": ...}}}; an item's next_search_after is sent back as its search_after
+    to fetch its next page.
+    Repeated items are looked up once; the same id with a different
+    is_attachment or search_after is rejected, as both would need the same result key.
+    """
+    items = payload.get("items")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Missing or invalid 'items' list.")
+    if len(items) > MAX_ATTACHMENT_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_ATTACHMENT_BATCH} items per batch.")
+
+    lean = bool(payload.get("lean", False))
+    highlight, highlight_query = attachment_highlight(payload)
+    build_started = time.perf_counter()
+    keys = []
+    kinds = {}  # key -> (is_attachment, search_after)
+    pages = []
+    lines = []
+    for item in items:
+        PropId = item.get("app_id")
+        ParentPropId = item.get("parent_app_id")
+        if PropId is None and ParentPropId is None:
+            raise HTTPException(status_code=400, detail="Every item needs app_id or parent_app_id")
+        key = PropId if PropId is not None else ParentPropId
+        is_attachment = parse_is_attachment(item.get("is_attachment"))
+        search_after = item.get("search_after")
+        if search_after is not None and not isinstance(search_after, list):
+            raise HTTPException(status_code=400, detail=f"Invalid search_after for item {key}")
+        if key in kinds:
+            if kinds[key] != (is_attachment, search_after):
+                raise HTTPException(status_code=400,
+                                    detail=f"Conflicting is_attachment/search_after for item {key}")
+            continue  # same row requested twice
+        kinds[key] = (is_attachment, search_after)
+        keys.append(key)
+        query = build_attachment_query(
+            PropId, ParentPropId, is_attachment,
+            size=attachment_page_size(item.get("size")), search_after=search_after, lean=lean,
+            highlight=highlight, highlight_query=highlight_query
+        )
+        pages.append((query["size"], is_attachment))
+        lines.append(b"{}\n")
+        lines.append(dumps_line(query))
+    msearch_body = b"".join(lines)
+    ATTACHMENT_BATCH_STAGE_SECONDS.observe(time.perf_counter() - build_started, "build_query")
 
+    try:
+        client = get_es_client()
+        with ATTACHMENT_BATCH_STAGE_SECONDS.time("es_request"):
+            response = await client.post(
+                f"{idx_url}/_msearch", content=msearch_body,
+                headers={"Content-Type": "application/x-ndjson"}, timeout=ES_ATTACHMENT_TIMEOUT
+            )
+        if response.status_code != 200:
+            logger.error(f"Elasticsearch error: {response.status_code} - {response.text}")
+            raise HTTPException(status_code=500, detail=f"Elasticsearch error: {response.status_code}")
+    except httpx.RequestError as e:
+        logger.error(f"Elasticsearch connection error: {str(e)}")
+        raise HTTPException(status_code=503, detail="Elasticsearch unavailable")
 
+    with ATTACHMENT_BATCH_STAGE_SECONDS.time("parse_json"):
+        item_responses = loads(response.content).get("responses", [])
+    results = {}
+    with ATTACHMENT_BATCH_STAGE_SECONDS.time("process_hits"):
+        if len(item_responses) != len(keys):
+            logger.error(f"_msearch returned {len(item_responses)} responses for {len(keys)} searches")
+        for index, (key, (size, is_attachment)) in enumerate(zip(keys, pages)):
+            item_response = item_responses[index] if index < len(item_responses) else None
+            if item_response is None:
+                results[key] = {"error": "No response for this item"}
+            elif "error" in item_response:
+                logger.error(f"Attachment lookup failed for {key}: {item_response['error']}")
+                results[key] = {"error": "Lookup failed"}
+            else:
+                raw_hits = item_response.get("hits", {}).get("hits", [])
+                results[key] = {
+                    "documents": process_attachment_hits(raw_hits),
+                    "next_search_after": attachment_next_search_after(raw_hits, size, is_attachment)
+                }
+    return FastJSONResponse(content={"results": results})
 
 
 # ---------------------------------------
+def build_query_body(
+    queries: List[str],
+    search_type: str = "any",
+    filters: Optional[Dict[str, List[str]]] = None,
+    date_range: Optional[Dict[str, str]] = None
+) -> dict:
+    """
+    Builds the bool query shared by paginated search, facets and export
+    (see query_builder for how clauses are laid out).
+    """
+    try:
+        return build_query(queries, search_type, filters, date_range)
+    except QueryBuildError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 async def search_elasticsearch(
     queries: List[str],
     size: int,
     search_type: str = "any",
     search_after: Optional[List] = None,
     filters: Optional[Dict[str, List[str]]] = None,
-    date_range: Optional[Dict[str, str]] = None
-) -> Tuple[List[dict], Optional[List]]:
+    date_range: Optional[Dict[str, str]] = None,
+    highlight: str = HIGHLIGHT_SNIPPET
+) -> Tuple[List[dict], Optional[List], int]:
     """
     Performs a search against Elasticsearch with pagination using search_after.
+    Facet counts are not part of this request; see compute_facets.
     """
-    if not queries:
-        raise HTTPException(status_code=400, detail="Query list cannot be empty")
-
-    must_clauses = []
-    should_clauses = []
-    print(queries)
-    search_fields_keywords=["OriginalName.keyword","PropId.keyword","ParentPropId.keyword"]
-    # Query clauses
-    if search_type == "all":
-
-        for q in queries:
-            sub_clauses=[]
-            sub_clauses.append({"match_phrase": {"Text": q}} )
-
-            for field in search_fields_keywords:
-                sub_clauses.append({"term": {field:q}})
-
-            must_clauses.append({"bool": {"should": sub_clauses,"minimum_should_match":1}})
-    elif search_type == "any":
-        for q in queries:
-            sub_clauses = []
-
-            sub_clauses.append({"match_phrase": {"Text": q}})
-
-            for field in search_fields_keywords:
-                sub_clauses.append({"term": {field: q}})
-
-            should_clauses.append({"bool": {"should": sub_clauses, "minimum_should_match": 1}})
-    else:
-        raise HTTPException(status_code=400, detail="Invalid search_type. Use 'any' or 'all'.")
-
-    # Filter clauses
-    if filters:
-        for field, values in filters.items():
-            if values:  # only if list is non-empty
-                keyword_field=f"{field}.keyword" if not field.endswith(".keyword") else field
-                must_clauses.append({
-                    "terms": {keyword_field: values}
-                })
-
-    # Date range clause
-    
-    if date_range:
-        range_filter = {}
-        if date_range.get("from"):
-            range_filter["gte"] = to_epoch_millis(date_range["from"])
-        if date_range.get("to"):
-            to_dt_naive=datetime.strptime(date_range["to"],"%Y-%m-%d")
-            next_day_date_obj=to_dt_naive.date()+timedelta(days=1)
-            next_day_start_dt_aware_utc=datetime.combine(next_day_date_obj,time.min,tzinfo=timezone.utc)
-            range_filter["lt"] = int(next_day_start_dt_aware_utc.timestamp())
-
-        if range_filter["gte"]:
-            print(f" 2nd {datetime.fromtimestamp(range_filter["gte"],tz=timezone.utc)}")
-        if range_filter["lt"]:
-            print(f" 3nd {datetime.fromtimestamp(range_filter["lt"],tz=timezone.utc)}")
-        
-        if range_filter:
-            must_clauses.append({
-                "range": {
-                    "DocumentDate": range_filter
-                }
-            })
-        elif range_filter:
-            print(f"4th {range_filter}")
-
-    # Final query
-    query_body = {
-        "bool": {
-            "must": must_clauses,
-            "should": should_clauses,
-            "minimum_should_match": 1 if should_clauses else 0
-        }
-    }
-
-    search_body = {
-        "size": size,
-        "sort": [
-            {"DocumentDate": "desc"},
-            {"_id": "asc"}
-        ],
-        "track_total_hits": True,
-        "query": query_body,
-        "highlight": {
-            "fields": {
-                "Text": {
-                "fragment_size":500,
-
-                "number_of_fragments":10,
-                "boundary_scanner":"sentence"
-                }
-            },
-            "pre_tags": ["<mark>"],
-            "post_tags": ["</mark>"]
-        }
-        }
+    with SEARCH_STAGE_SECONDS.time("build_query"):
+        query_body = build_query_body(queries, search_type, filters, date_range)
+        search_body = build_search_body(query_body, size, search_after, highlight)
 
-    print(search_body)
-
-    if search_after:
-        search_body["search_after"] = search_after
-
-# add agrregation for doc
-    
-    search_body["aggs"]={
-        "doctype_counts":{
-            "terms":{
-                "field": "DocType.keyword",
-                "size":100
-            }
-        },
-        #  added for branch type
-         "branchtype_counts":{
-            "terms":{
-                "field": "Branch.keyword",
-                "size":100
-            }
-        },
-
-          "extensiontype_counts":{
-            "terms":{
-                "field": "FileExtension.keyword",
-                "size":100
-            }  }
-
-
-    }
-
-    
+    # Identical searches (same body, same index generation) are served from memory
+    with SEARCH_STAGE_SECONDS.time("cache_lookup"):
+        cache_key = make_cache_key(search_body)
+        cached = search_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            print("before sending to es")
-            url = f"{idx_url}/_search"
-            print("after sending to es")
-            response = await client.post(url, json=search_body)
-
-            if response.status_code != 200:
-                logger.error(f"Elasticsearch error: {response.status_code} - {response.text}")
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Elasticsearch responded with status code {response.status_code}: {response.text}"
-                )
-
-        data = response.json()
+        client = get_es_client()
+        url = f"{idx_url}/_search"
+        logger.debug("Sending search to Elasticsearch", extra={"fields": {"search_body": search_body}})
+        with SEARCH_STAGE_SECONDS.time("es_request"):
+            response = await client.post(url, json=search_body, timeout=ES_SEARCH_TIMEOUT)
+
+        if response.status_code != 200:
+            logger.error(f"Elasticsearch error: {response.status_code} - {response.text}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Elasticsearch responded with status code {response.status_code}: {response.text}"
+            )
+
+        with SEARCH_STAGE_SECONDS.time("parse_json"):
+            data = loads(response.content)
         raw_hits = data.get("hits", {}).get("hits", [])
         total_hits=0
         hits_total=data.get("hits", {}).get("total", [])
@@ -353,31 +400,27 @@ async def search_elasticsearch(
 
 
         # Process highlights
+        process_started = time.perf_counter()
         processed_hits = []
         for hit in raw_hits:
             source = hit["_source"]
             
             
+            # Text itself is not fetched (see RESULT_LIST_SOURCE); when nothing matched,
+            # the highlighter's no_match_size returns the opening characters instead
             highlight = hit.get("highlight", {}).get("Text", [])
-            source["Text"]=source["Text"][:100]
-            # print(source)
             if highlight:
                 source["highlighted_text"] = highlight[0]
             else:
-                source["highlighted_text"] = source.get("Text", "")
+                source["highlighted_text"] = ""
 
                 
             if source["IsAttachment"]=="False":
-                attachment_path=source.get("Attachments","")
-                if attachment_path:
-                    # Use a tuple of delimiters to split the string
-                    split_result = re.split(r',|@@@@',attachment_path)
-                    # Filter out any empty strings and count the non-empty parts
-                    a_count = len([x.strip() for x in split_result if x.strip()])
-                    
-                    print(a_count)
-                else:
-                    a_count=0
+                # AttachmentCount is computed at ingest; only documents indexed
+                # before it existed still need the string parsed here
+                a_count = source.get("AttachmentCount")
+                if a_count is None:
+                    a_count = len(split_attachment_paths(source.get("Attachments", "")))
                 source["a_count"]=a_count
             
             processed_hit = {
@@ -387,55 +430,168 @@ async def search_elasticsearch(
             processed_hits.append(processed_hit)
 
         last_sort_value = raw_hits[-1]["sort"] if raw_hits else None
+        SEARCH_STAGE_SECONDS.observe(time.perf_counter() - process_started, "process_hits")
 
 
+        logger.debug("Search returned %d of %d hits", len(processed_hits), total_hits)
+        result = (processed_hits, last_sort_value, total_hits)
+        search_cache.set(cache_key, result, size=len(response.content))
+        return result
 
-        # extracting and formatting aggrefgation results
-        doc_type_counts={}
-        branch_type_counts={}
-        extension_type_counts={}
-        # Check if 'aggregations' key exists in the response
-        if "aggregations" in data:
-            # Extract the bucket results from the 'doctype_counts' aggregation
-            doctype_counts = data["aggregations"]["doctype_counts"]
-            branchtype_counts=data["aggregations"]["branchtype_counts"]
-            extensiontype_counts=data["aggregations"]["extensiontype_counts"]
-            # Iterate over each bucket and store the counts in doc_type_counts
-            for bucket in doctype_counts.get("buckets", []):
-                key = bucket.get("key")
-                doc_count = bucket.get("doc_count")
-                
-                if key is not None and doc_count is not None:
-                    doc_type_counts[key] = doc_count
+    except httpx.RequestError as e:
+        logger.error(f"Elasticsearch connection error: {str(e)}")
+        raise HTTPException(status_code=503, detail="Elasticsearch is unavailable")
+    except Exception as e:
+        logger.exception("Unexpected error during Elasticsearch query")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
-            for bucket in branchtype_counts.get("buckets",[]):
-                key = bucket.get("key")
-                branch_count=bucket.get("doc_count")
 
-                if key is not None and branch_count is not None:
-                    branch_type_counts[key]=branch_count
+# ---------------------------------------
+async def compute_facets(query_body: dict) -> Dict[str, Dict[str, int]]:
+    """
+    Facet counts (doc type, branch, extension) for a query. They depend only on
+    the query and filters, not on the page, so they are computed in a separate
+    size-0 request and cached for FACET_CACHE_TTL seconds.
+    """
+    cache_key = make_cache_key(query_body)
+    cached = facet_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-            for bucket in extensiontype_counts.get("buckets",[]):
-                key = bucket.get("key")
-                extension_count=bucket.get("doc_count")
+    search_body = {
+        "size": 0,
+        "track_total_hits": False,
+        "query": query_body,
+        "aggs": {
+            name: {"terms": {"field": field, "size": FACET_SIZE}}
+            for name, field in FACET_FIELDS.items()
+        }
+    }
 
-                if key is not None and extension_count is not None:
-                    extension_type_counts[key]=extension_count
+    try:
+        client = get_es_client()
+        # size=0 requests are also eligible for the ES shard request cache
+        response = await client.post(f"{idx_url}/_search", params={"request_cache": "true"},
+                                     json=search_body, timeout=ES_SEARCH_TIMEOUT)
+        if response.status_code != 200:
+            logger.error(f"Elasticsearch error: {response.status_code} - {response.text}")
+            raise HTTPException(
+                status_code=500,
+                detail=f"Elasticsearch responded with status code {response.status_code}: {response.text}"
+            )
+        aggregations = loads(response.content).get("aggregations", {})
+    except httpx.RequestError as e:
+        logger.error(f"Elasticsearch connection error: {str(e)}")
+        raise HTTPException(status_code=503, detail="Elasticsearch is unavailable")
 
+    facets = {}
+    for name in FACET_FIELDS:
+        counts = {}
+        for bucket in aggregations.get(name, {}).get("buckets", []):
+            key = bucket.get("key")
+            doc_count = bucket.get("doc_count")
+            if key is not None and doc_count is not None:
+                counts[key] = doc_count
+        facets[name] = counts
 
+    logger.debug("Computed facets", extra={"fields": {"facets": facets}})
+    facet_cache.set(cache_key, facets)
+    return facets
 
-        # Print the resulting doc_type_counts dictionary
-        print(doc_type_counts)
 
+# ---------------------------------------
+async def open_point_in_time() -> str:
+    """
+    Opens a point-in-time on the index so an export sees one consistent snapshot.
+    """
+    client = get_es_client()
+    response = await client.post(f"{idx_url}/_pit", params={"keep_alive": EXPORT_PIT_KEEP_ALIVE}, timeout=ES_SEARCH_TIMEOUT)
+    if response.status_code != 200:
+        logger.error(f"Elasticsearch error opening PIT: {response.status_code} - {response.text}")
+        raise HTTPException(status_code=500, detail=f"Elasticsearch could not open a point in time: {response.status_code}")
+    return loads(response.content)["id"]
 
-        return processed_hits, last_sort_value,doc_type_counts,branch_type_counts,extension_type_counts,total_hits
 
+async def close_point_in_time(pit_id: str) -> None:
+    try:
+        client = get_es_client()
+        await client.request("DELETE", f"{ES_HOST}_pit", json={"id": pit_id}, timeout=ES_SEARCH_TIMEOUT)
     except httpx.RequestError as e:
-        logger.error(f"Elasticsearch connection error: {str(e)}")
-        raise HTTPException(status_code=503, detail="Elasticsearch is unavailable")
-    except Exception as e:
-        logger.exception("Unexpected error during Elasticsearch query")
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+        # PITs expire on their own after keep_alive; nothing else to do
+        logger.warning(f"Could not close point in time: {str(e)}")
+
+
+class ExportAborted(RuntimeError):
+    """Raised from the export stream so the client sees an incomplete transfer."""
+
+
+async def export_documents(
+    query_body: dict,
+    pit_id: str,
+    page_size: Optional[int] = None
+) -> AsyncGenerator[bytes, None]:
+    """
+    Yields every matching document as NDJSON in chunks of about
+    EXPORT_CHUNK_BYTES, walking a point-in-time with search_after. Pages are lean: no aggregations, no
+    highlighting and no hit counting. Closes the PIT when done.
+
+    The status line is already sent when ES fails mid-export, so the failure
+    is reported in the body: a last {"error": ...} line, then the stream is
+    aborted (no clean end of the chunked body).
+    """
+    page_size = page_size or EXPORT_PAGE_SIZE
+    search_after = None
+    exported = 0
+    failure = None
+    try:
+        client = get_es_client()
+        while True:
+            search_body = {
+                "size": page_size,
+                "query": query_body,
+                "pit": {"id": pit_id, "keep_alive": EXPORT_PIT_KEEP_ALIVE},
+                "sort": [
+                    {"DocumentDate": "desc"},
+                    {"_shard_doc": "asc"}
+                ],
+                "track_total_hits": False
+            }
+            if search_after:
+                search_body["search_after"] = search_after
+
+            response = await client.post(f"{ES_HOST}_search", json=search_body, timeout=ES_SEARCH_TIMEOUT)
+            if response.status_code != 200:
+                logger.error(f"Elasticsearch error during export: {response.status_code} - {response.text}")
+                failure = f"Elasticsearch responded with status code {response.status_code}"
+                break
+
+            data = loads(response.content)
+            pit_id = data.get("pit_id", pit_id)  # ES may hand back a refreshed id
+            hits = data.get("hits", {}).get("hits", [])
+            if not hits:
+                break
+
+            for chunk in iter_ndjson_chunks((hit["_source"] for hit in hits), EXPORT_CHUNK_BYTES):
+                yield chunk
+            exported += len(hits)
+
+            if len(hits) < page_size:
+                break
+            search_after = hits[-1]["sort"]
+    except httpx.RequestError as e:
+        logger.error(f"Elasticsearch connection error during export after {exported} documents: {str(e)}")
+        failure = "Elasticsearch is unavailable"
+    except Exception:
+        logger.exception(f"Unexpected error during export after {exported} documents")
+        failure = "Internal Server Error"
+    finally:
+        await close_point_in_time(pit_id)
+        if failure is None:
+            logger.info(f"Export finished: {exported} documents")
+
+    if failure is not None:
+        yield dumps_line({"error": failure, "exported": exported, "complete": False})
+        raise ExportAborted(f"Export aborted after {exported} documents: {failure}")
 
 
 # ---------------------------------------
@@ -447,6 +603,8 @@ async def stream_or_paginate_search(
     Handles search requests: 
     - Streams full results if stream=True 
     - Else paginated fetch (one batch at a time)
+    "highlight" picks the snippet under each hit: "snippet" (default, one
+    fragment) or "none" for calls that only page through or count results.
     """
     queries = payload.get("queries", [])
     size = payload.get("size", 100)
@@ -463,48 +621,157 @@ async def stream_or_paginate_search(
         size = 100  # Fallback safe default
 
     if stream:
-        # Full streaming mode
-        async def document_generator() -> AsyncGenerator[str, None]:
-            nonlocal search_after
-            first = True
-            yield "["
-            while True:
-                hits, search_after = await search_elasticsearch(
-                    queries, size, search_type, search_after, filters, date_range
-                )
-                if not hits:
-                    break
-                for hit in hits:
-                    doc_json = hit["_source"]
-                    doc_str = f"{'' if first else ','}{json.dumps(doc_json)}"
-                    yield doc_str
-                    first = False
-                if search_after is None:
-                    break
-            yield "]"
-
-        return StreamingResponse(document_generator(), media_type="application/json")
+        # Bulk export mode: NDJSON over a point-in-time, bounded memory
+        query_body = build_query_body(queries, search_type, filters, date_range)
+        try:
+            pit_id = await open_point_in_time()
+        except httpx.RequestError as e:
+            logger.error(f"Elasticsearch connection error: {str(e)}")
+            raise HTTPException(status_code=503, detail="Elasticsearch is unavailable")
+
+        return StreamingResponse(export_documents(query_body, pit_id), media_type="application/x-ndjson")
 
     else:
         # Paginated mode
-        print("abcd")
-        hits, last_sort_value,doctype_counts,branchtype_counts,extensiontype_counts,hits_total = await search_elasticsearch(
-            queries, size, search_type, search_after, filters, date_range
-        )
+        # Facets are the same for every page of a query, so they only ride along
+        # on the first page (or when asked for); later pages skip aggregation.
+        include_facets = payload.get("include_facets", search_after is None)
+        highlight = highlight_profile(payload.get("highlight"), HIGHLIGHT_SNIPPET)
+        # Validate everything (400s) before creating coroutines, which would
+        # otherwise be left un-awaited
+        query_body = build_query_body(queries, search_type, filters, date_range)
+        if include_facets:
+            (hits, last_sort_value, hits_total), facets = await asyncio.gather(
+                search_elasticsearch(queries, size, search_type, search_after, filters, date_range, highlight),
+                compute_facets(query_body)
+            )
+        else:
+            hits, last_sort_value, hits_total = await search_elasticsearch(
+                queries, size, search_type, search_after, filters, date_range, highlight
+            )
+            facets = None
 
         documents = [hit["_source"] for hit in hits]
-        
-        print(hits_total)
-        return JSONResponse(content={
+
+        content = {
             "documents": documents,
             "next_search_after": last_sort_value,
-            "aggregations":{
-                "doctype_counts": doctype_counts,
-                "branchtype_counts": branchtype_counts,
-                "extensiontype_counts":extensiontype_counts
-            },
-            "total":hits_total
+            "total": hits_total
+        }
+        if facets is not None:
+            content["aggregations"] = facets
+        return FastJSONResponse(content=content)
 
-        })
 
+@app.post("/search/facets")
+async def search_facets(payload: Dict[str, Any] = Body(...)):
+    """
+    Facet counts only, for the same payload as /search (cached per query/filter set).
+    """
+    queries = payload.get("queries", [])
+    if not queries or not isinstance(queries, list):
+        raise HTTPException(status_code=400, detail="Missing or invalid 'queries' list.")
+
+    query_body = build_query_body(
+        queries, payload.get("search_type", "any"), payload.get("filters", {}), payload.get("date_range", {})
+    )
+    return FastJSONResponse(content={"aggregations": await compute_facets(query_body)})
+
+
+@app.post("/search/dsl")
+async def search_dsl(payload: Dict[str, Any] = Body(...)):
+    """
+    Returns the Elasticsearch request /search would send for this payload, without running it.
+    """
+    size = payload.get("size", 100)
+    if not isinstance(size, int) or size <= 0:
+        size = 100
+    query_body = build_query_body(
+        payload.get("queries", []), payload.get("search_type", "any"),
+        payload.get("filters", {}), payload.get("date_range", {})
+    )
+    highlight = highlight_profile(payload.get("highlight"), HIGHLIGHT_SNIPPET)
+    return FastJSONResponse(content={
+        "search_body": build_search_body(query_body, size, payload.get("search_after"), highlight)
+    })
+
+
+async def fetch_document_source(prop_id: str, highlight: Optional[dict] = None) -> Optional[dict]:
+    """
+    The document's _source; with a highlight section, also its highlighted
+    Text as "highlighted_text" (when anything matched).
+    """
+    query = {
+        "query": {"bool": {"filter": [{"term": {PROP_ID_FIELD: prop_id}}]}},
+        "size": 1
+    }
+    if highlight is not None:
+        query["highlight"] = highlight
+    try:
+        client = get_es_client()
+        response = await client.post(f"{idx_url}/_search", json=query, timeout=ES_SEARCH_TIMEOUT)
+        if response.status_code != 200:
+            logger.error(f"Elasticsearch error: {response.status_code} - {response.text}")
+            raise HTTPException(status_code=500, detail=f"Elasticsearch error: {response.status_code}")
+    except httpx.RequestError as e:
+        logger.error(f"Elasticsearch connection error: {str(e)}")
+        raise HTTPException(status_code=503, detail="Elasticsearch unavailable")
 
+    hits = loads(response.content).get("hits", {}).get("hits", [])
+    if not hits:
+        return None
+    source = hits[0]["_source"]
+    fragments = hits[0].get("highlight", {}).get("Text", [])
+    if fragments:
+        source["highlighted_text"] = fragments[0]
+    return source
+
+
+@app.get("/documents/{prop_id}")
+async def get_document_detail(
+    prop_id: str,
+    queries: Optional[List[str]] = Query(None),
+    highlight: Optional[str] = None
+):
+    """
+    Full stored record for one document, including the extracted Text that
+    result lists leave out. Content duplicates store no text of their own;
+    theirs is taken from the canonical document while both still have the
+    same Hash (otherwise the duplicate is returned without text).
+    With ?queries=..., the search terms are also marked in "highlighted_text":
+    all of Text by default (highlight=full), or highlight=snippet for one fragment.
+    """
+    highlight_section = None
+    if queries:
+        profile = highlight_profile(highlight, HIGHLIGHT_FULL)
+        try:
+            highlight_section = highlight_clause(profile, text_highlight_query(queries))
+        except QueryBuildError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    source = await fetch_document_source(prop_id, highlight_section)
+    if source is None:
+        raise HTTPException(status_code=404, detail=f"Document not found: {prop_id}")
+    canonical_id = source.get(CANONICAL_FIELD)
+    if canonical_id and not source.get("Text"):
+        canonical = await fetch_document_source(canonical_id, highlight_section)
+        if canonical is None:
+            logger.warning(f"Canonical document {canonical_id} of {prop_id} not found")
+        elif canonical.get("Hash") != source.get("Hash"):
+            # The canonical document changed since this duplicate was indexed;
+            # its text is no longer this document's text
+            logger.warning(f"Canonical document {canonical_id} of {prop_id} has different content; "
+                           f"returning {prop_id} without text")
+        else:
+            for field in DEDUPLICATED_FIELDS + ("highlighted_text",):
+                if field in canonical:
+                    source[field] = canonical[field]
+    return FastJSONResponse(content={"document": source})
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus scrape endpoint: per-stage latency histograms and cache hit ratios.
+    """
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+SEARCH_CACHE_GENERATION_FILE = os.getenv(
+    "SEARCH_CACHE_GENERATION_FILE", os.path.join(tempfile.gettempdir(), "search_cache_generation")
+)
+
+
+def make_cache_key(body: Any) -> str:
+    """
+    Stable hash of a JSON-able request body (key order does not matter).
+    """
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class GenerationCounter:
+    """
+    Index generation shared between processes through a small file. Ingestion
+    bumps it after writing to the index; caches drop everything they hold when
+    they see it change. Readers look at the file at most every `check_interval` seconds.
+    """
+
+    def __init__(self, path: str = SEARCH_CACHE_GENERATION_FILE, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._value = 0
+        self._checked_at = float("-inf")
+
+    def _read(self) -> int:
+        try:
+            with open(self.path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def current(self) -> int:
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._value = self._read()
+            self._checked_at = now
+        return self._value
+
+    def bump(self) -> int:
+        value = self._read() + 1
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".generation_")
+        with os.fdopen(fd, "w") as f:
+            f.write(str(value))
+        os.replace(tmp_path, self.path)
+        self._value = value
+        self._checked_at = time.monotonic()
+        return value
+
+
+def bump_search_generation() -> int:
+    """
+    Invalidates every search/facet cache entry in all processes sharing the generation file.
+    """
+    return GenerationCounter().bump()
+
+
+class TTLCache:
+    """
+    Small in-process LRU cache whose entries expire `ttl` seconds after being set.
+    Optionally bounded by total size in bytes (as reported to `set`) and tied to a
+    GenerationCounter, in which case a generation change empties the cache.
+    Not thread-safe; meant to be used from the event loop.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_bytes: Optional[int] = None,
+                 generation: Optional[GenerationCounter] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.generation = generation
+        self._generation_seen = generation.current() if generation is not None else 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, size, value)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _check_generation(self) -> None:
+        if self.generation is None:
+            return
+        current = self.generation.current()
+        if current != self._generation_seen:
+            self.clear()
+            self._generation_seen = current
+
+    def _remove(self, key: str) -> None:
+        _expires_at, size, _value = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key: str) -> Optional[Any]:
+        self._check_generation()
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: str, value: Any, size: int = 0) -> None:
+        self._check_generation()
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # would evict everything else; not worth caching
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None and self.total_bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.total_bytes = 0
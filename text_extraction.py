@@ -0,0 +1,247 @@
+"""
+Text extraction for ingestion: fills Text from the file a record's
+SystemPath points to (PDF, DOCX, XLSX, TXT).
+
+Parsing is CPU-bound, so it runs in a process pool. Each worker runs under
+an address-space limit and each file gets a time limit; a file that exceeds
+either is logged and indexed without text instead of stalling the load.
+"""
+import logging
+import os
+import signal
+from collections import deque
+from multiprocessing import Pool, TimeoutError as PoolTimeoutError
+from pathlib import Path
+from typing import Deque, Iterable, Iterator, Optional, Tuple
+
+try:
+    import resource  # Unix only
+except ImportError:
+    resource = None
+
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import docx  # python-docx
+except ImportError:
+    docx = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+
+logger = logging.getLogger(__name__)
+
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "60"))  # seconds per file
+EXTRACT_MAX_MEMORY_MB = int(os.getenv("EXTRACT_MAX_MEMORY_MB", "1024"))  # per worker process
+# Longer texts are truncated; keeps single bulk actions within ES request limits
+EXTRACT_MAX_CHARS = int(os.getenv("EXTRACT_MAX_CHARS", str(10 * 1024 * 1024)))
+# Workers are replaced after this many files, releasing memory parsers leak
+EXTRACT_MAX_TASKS_PER_WORKER = int(os.getenv("EXTRACT_MAX_TASKS_PER_WORKER", "200"))
+
+# Extra time the parent waits past EXTRACT_TIMEOUT before giving up on a
+# worker that did not answer at all (killed by the OS, stuck in C code)
+RESULT_GRACE_SECONDS = 10.0
+
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+def _read_pdf(path: Path) -> str:
+    reader = PdfReader(str(path))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def _read_docx(path: Path) -> str:
+    document = docx.Document(str(path))
+    parts = [p.text for p in document.paragraphs]
+    for table in document.tables:
+        for row in table.rows:
+            parts.append("\t".join(cell.text for cell in row.cells))
+    return "\n".join(parts)
+
+
+def _read_xlsx(path: Path) -> str:
+    workbook = openpyxl.load_workbook(str(path), read_only=True, data_only=True)
+    try:
+        lines = []
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(values_only=True):
+                values = [str(v) for v in row if v is not None]
+                if values:
+                    lines.append("\t".join(values))
+        return "\n".join(lines)
+    finally:
+        workbook.close()
+
+
+def _read_txt(path: Path) -> str:
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read(EXTRACT_MAX_CHARS + 1)
+
+
+# suffix -> (reader, library it needs or True if none)
+EXTRACTORS = {
+    ".pdf": (_read_pdf, PdfReader),
+    ".docx": (_read_docx, docx),
+    ".xlsx": (_read_xlsx, openpyxl),
+    ".txt": (_read_txt, True),
+}
+
+
+def can_extract(path: str) -> bool:
+    entry = EXTRACTORS.get(Path(path).suffix.lower())
+    return entry is not None and entry[1] is not None
+
+
+# --- Worker side -----------------------------------------------------------
+def _on_alarm(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _init_worker(max_memory_mb: int) -> None:
+    # The parent handles Ctrl+C and terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    if resource is not None and max_memory_mb > 0:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def extract_file(path: str, timeout: float) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Runs in a worker. Returns (text, None) or (None, error message).
+    """
+    reader, _library = EXTRACTORS[Path(path).suffix.lower()]
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        text = reader(Path(path))
+    except ExtractionTimeout:
+        return None, f"timed out after {timeout:.0f}s"
+    except MemoryError:
+        return None, "memory limit exceeded"
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    return text[:EXTRACT_MAX_CHARS], None
+
+
+# --- Parent side -----------------------------------------------------------
+class ExtractionStats:
+    def __init__(self):
+        self.extracted = 0
+        self.failed = 0
+        self.skipped = 0
+
+
+class TextExtractor:
+    """
+    Process pool that fills in Text on records streaming through
+    `extract_records`. Use as a context manager.
+    """
+
+    def __init__(self, workers: int = EXTRACT_WORKERS, timeout: float = EXTRACT_TIMEOUT,
+                 max_memory_mb: int = EXTRACT_MAX_MEMORY_MB):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb
+        self.stats = ExtractionStats()
+        self._pool = None
+
+    def __enter__(self) -> "TextExtractor":
+        missing = [suffix for suffix, (_reader, library) in EXTRACTORS.items() if library is None]
+        if missing:
+            logger.warning(f"No extraction library installed for {', '.join(missing)}; those files are skipped")
+        self._pool = self._new_pool()
+        return self
+
+    def _new_pool(self):
+        return Pool(
+            self.workers, initializer=_init_worker, initargs=(self.max_memory_mb,),
+            maxtasksperchild=EXTRACT_MAX_TASKS_PER_WORKER,
+        )
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self._pool.close()
+        else:
+            self._pool.terminate()
+        self._pool.join()
+        self._pool = None
+
+    def _needs_text(self, record: dict) -> bool:
+        path = record.get("SystemPath")
+        # Duplicates (content_dedup.py) reference their canonical document's text
+        if record.get("Text") or record.get("CanonicalPropId") or not path:
+            return False
+        if not can_extract(path):
+            self.stats.skipped += 1
+            return False
+        return True
+
+    def _submit(self, record: dict):
+        return self._pool.apply_async(extract_file, (record["SystemPath"], self.timeout))
+
+    def _restart_pool(self, window: Deque[Tuple[dict, object]]) -> None:
+        """
+        Replaces the pool after a worker stopped answering: a worker stuck in C
+        code ignores SIGALRM and would otherwise hold its slot for the rest of
+        the run. Files in the window that had not finished are submitted again.
+        """
+        logger.warning("Restarting the text extraction pool to get rid of an unresponsive worker")
+        self._pool.terminate()
+        self._pool.join()
+        self._pool = self._new_pool()
+        for i, (record, pending) in enumerate(window):
+            if pending is not None and not pending.ready():
+                window[i] = (record, self._submit(record))
+
+    def _collect(self, record: dict, pending, window: Deque[Tuple[dict, object]]) -> dict:
+        # The pool runs tasks in submission order and everything submitted
+        # before this one has been collected, so it is running by now
+        path = record["SystemPath"]
+        try:
+            text, error = pending.get(timeout=self.timeout + RESULT_GRACE_SECONDS)
+        except PoolTimeoutError:
+            text, error = None, "worker did not respond (killed or stuck)"
+            self._restart_pool(window)
+        if error is None:
+            record["Text"] = text
+            self.stats.extracted += 1
+        else:
+            self.stats.failed += 1
+            logger.error(f"Text extraction failed for {path}: {error}")
+        return record
+
+    def extract_records(self, records: Iterable[dict]) -> Iterator[dict]:
+        """
+        Yields the records in input order, with Text filled in where it was
+        empty and SystemPath names a supported file. At most 4 files per
+        worker are in flight, so a slow file holds back only a bounded window.
+        """
+        window: Deque[Tuple[dict, object]] = deque()
+        max_in_flight = self.workers * 4
+        for record in records:
+            if self._needs_text(record):
+                window.append((record, self._submit(record)))
+            else:
+                window.append((record, None))
+            while window and (len(window) > max_in_flight or window[0][1] is None or window[0][1].ready()):
+                yield self._finish(window)
+        while window:
+            yield self._finish(window)
+
+    def _finish(self, window: Deque[Tuple[dict, object]]) -> dict:
+        record, pending = window.popleft()
+        if pending is None:
+            return record
+        return self._collect(record, pending, window)